@@ -0,0 +1,70 @@
+'''
+Cost of the JSON codec on Home Assistant websocket frames.
+
+    python benchmarks/codec_benchmark.py [traffic.jsonl]
+
+Times codec.loads, codec.dumps and codec.peek_message on their own, next to the stdlib json equivalents.
+Frames come from a capture written by record_traffic.py (one frame per line);
+record your own installation with it to measure realistic sizes.
+`ha_traffic.jsonl` was recorded with `--anonymize` from `python -m homedeck.fake_home_assistant --entities 200 --storm-rate 50`.
+'''
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from homedeck import codec  # noqa: E402
+
+ROUNDS = 20
+
+
+def stdlib_loads(frames, _):
+    ''' What the client used to do: decode every frame to str, then parse it '''
+    for frame in frames:
+        json.loads(frame.decode('utf-8'))
+
+
+def codec_loads(frames, _):
+    for frame in frames:
+        codec.loads(frame)
+
+
+def stdlib_dumps(_, messages):
+    for message in messages:
+        json.dumps(message).encode('utf-8')
+
+
+def codec_dumps(_, messages):
+    for message in messages:
+        codec.dumps(message)
+
+
+def codec_peek_message(frames, _):
+    for frame in frames:
+        codec.peek_message(frame)
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ha_traffic.jsonl')
+    with open(path, 'rb') as fp:
+        frames = [line.rstrip(b'\n') for line in fp if line.strip()]
+    messages = [json.loads(frame) for frame in frames]
+
+    total_size = sum(len(frame) for frame in frames)
+    print(f'{len(frames)} frames, {total_size / 1024:.0f} KiB, codec: {codec.CODEC_NAME}')
+
+    for name, func in (
+        ('json.loads', stdlib_loads),
+        ('codec.loads', codec_loads),
+        ('json.dumps', stdlib_dumps),
+        ('codec.dumps', codec_dumps),
+        ('codec.peek_message', codec_peek_message),
+    ):
+        seconds = min(timeit.repeat(lambda: func(frames, messages), number=ROUNDS, repeat=5)) / ROUNDS
+        print(f'{name:>18}: {seconds * 1000:7.2f} ms/pass, {seconds / len(frames) * 1e6:6.1f} us/frame')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+'''
+Records the websocket frames Home Assistant sends to HomeDeck, for codec_benchmark.py.
+
+    HA_HOST=ws://homeassistant.local:8123 HA_ACCESS_TOKEN=... python benchmarks/record_traffic.py traffic.jsonl --duration 60
+
+Subscribes like HomeDeck does (subscribe_entities + state_changed events) and writes one frame per line.
+With `--anonymize`, entity IDs, names and user IDs are replaced before writing.
+'''
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import websockets
+
+# Attributes that may hold names of people or places
+PRIVATE_ATTRIBUTES = {'friendly_name', 'user_id', 'latitude', 'longitude', 'gps_accuracy', 'entity_picture'}
+
+
+class Anonymizer:
+    def __init__(self):
+        self._entity_ids = {}
+
+    def entity_id(self, entity_id: str) -> str:
+        if entity_id not in self._entity_ids:
+            domain = entity_id.split('.', 1)[0]
+            self._entity_ids[entity_id] = f'{domain}.entity_{len(self._entity_ids) + 1}'
+
+        return self._entity_ids[entity_id]
+
+    def attributes(self, entity_id: str, attributes: dict) -> dict:
+        attributes = {key: None if key in PRIVATE_ATTRIBUTES else value for key, value in attributes.items()}
+        if 'friendly_name' in attributes:
+            attributes['friendly_name'] = self.entity_id(entity_id).split('.', 1)[1].replace('_', ' ').title()
+        return attributes
+
+    def compressed_state(self, entity_id: str, state: dict) -> dict:
+        ''' An added state ("a" attributes) or a change ("+" with new attributes) '''
+        if 'a' in state:
+            state = {**state, 'a': self.attributes(entity_id, state['a'])}
+        if 'a' in state.get('+', {}):
+            state = {**state, '+': {**state['+'], 'a': self.attributes(entity_id, state['+']['a'])}}
+        return state
+
+    def full_state(self, state: dict) -> dict:
+        if not state:
+            return state
+
+        entity_id = state['entity_id']
+        return {
+            **state,
+            'entity_id': self.entity_id(entity_id),
+            'attributes': self.attributes(entity_id, state.get('attributes', {})),
+            'context': {**state.get('context', {}), 'user_id': None},
+        }
+
+    def message(self, message: dict) -> dict:
+        event = message.get('event')
+        if message.get('type') != 'event' or not isinstance(event, dict):
+            return message
+
+        if 'event_type' in event:
+            data = event.get('data', {})
+            event = {**event, 'data': {
+                **data,
+                'entity_id': self.entity_id(data['entity_id']) if 'entity_id' in data else None,
+                'old_state': self.full_state(data.get('old_state')),
+                'new_state': self.full_state(data.get('new_state')),
+            }, 'context': {**event.get('context', {}), 'user_id': None}}
+        else:
+            # subscribe_entities: added ("a"), changed ("c") and removed ("r") entities
+            event = dict(event)
+            for key in ('a', 'c'):
+                if key in event:
+                    event[key] = {self.entity_id(entity_id): self.compressed_state(entity_id, state) for entity_id, state in event[key].items()}
+            if 'r' in event:
+                event['r'] = [self.entity_id(entity_id) for entity_id in event['r']]
+
+        return {**message, 'event': event}
+
+
+async def record(path: str, duration: float, anonymize: bool):
+    host = os.getenv('HA_HOST', 'ws://127.0.0.1:8123')
+    anonymizer = Anonymizer() if anonymize else None
+
+    frames = []
+    async with websockets.connect(f'{host}/api/websocket', max_size=None) as ws:
+        frames.append(await ws.recv(decode=False))
+        await ws.send(json.dumps({'type': 'auth', 'access_token': os.getenv('HA_ACCESS_TOKEN')}))
+        frames.append(await ws.recv(decode=False))
+
+        await ws.send(json.dumps({'id': 1, 'type': 'subscribe_entities'}))
+        await ws.send(json.dumps({'id': 2, 'type': 'subscribe_events', 'event_type': 'state_changed'}))
+
+        end = time.monotonic() + duration
+        while (timeout := end - time.monotonic()) > 0:
+            try:
+                frames.append(await asyncio.wait_for(ws.recv(decode=False), timeout))
+            except asyncio.TimeoutError:
+                break
+
+    with open(path, 'wb') as fp:
+        for frame in frames:
+            if anonymizer:
+                frame = json.dumps(anonymizer.message(json.loads(frame)), separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+            fp.write(frame.replace(b'\n', b'') + b'\n')
+
+    print(f'{len(frames)} frames written to {path}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Record Home Assistant websocket traffic')
+    parser.add_argument('path')
+    parser.add_argument('--duration', type=float, default=60, help='Seconds to record')
+    parser.add_argument('--anonymize', action='store_true', help='Replace entity IDs, names and user IDs')
+    args = parser.parse_args()
+
+    asyncio.run(record(args.path, args.duration, args.anonymize))
+
+
+if __name__ == '__main__':
+    main()
@@ -12,7 +12,7 @@ git clone https://github.com/redphx/homedeck.git
 # Create custom venv
 python3 -m venv /app/homedeck-venv
 # Install HomeDeck
-source /app/homedeck-venv/bin/activate && cd /app/homedeck && pip install -e .
+source /app/homedeck-venv/bin/activate && cd /app/homedeck && pip install -e '.[fast]'
 
 # Run HomeDeck at startup
 ( crontab -l 2>/dev/null; echo "@reboot /bin/bash -c 'source /app/homedeck-venv/bin/activate && python /app/homedeck/server.py'" ) | crontab -
@@ -1,5 +1,4 @@
 import asyncio
-import json
 import logging
 import os
 import re
@@ -18,6 +17,7 @@ from fastapi import FastAPI, Request, Response, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
 from zeroconf import InterfaceChoice, ServiceInfo, Zeroconf
 
+from homedeck import codec
 from homedeck.utils import deep_merge
 
 logger = logging.getLogger(__name__)
@@ -120,7 +120,7 @@ async def read_script_output():
 async def broadcast_messages():
     while True:
         message = await app.state.broadcast_queue.get()
-        json_message = json.dumps(message)
+        json_message = codec.dumps(message).decode('utf-8')
 
         disconnected_clients = set()
 
@@ -0,0 +1,131 @@
+import asyncio
+import traceback
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Hashable, Set
+
+from .home_assistant import HomeAssistantError
+
+# Calling them twice in a row with the same data does the same as calling them once
+IDEMPOTENT_SERVICES = {
+    'turn_on', 'turn_off',
+    'open_cover', 'close_cover', 'stop_cover',
+    'lock', 'unlock',
+    'media_play', 'media_pause', 'media_stop',
+    'select_option', 'set_value', 'set_percentage', 'set_temperature', 'set_hvac_mode', 'volume_set',
+}
+# Relative values, pending calls are merged by adding them up
+STEP_KEYS = ('brightness_step', 'brightness_step_pct')
+# Pending calls per entity, the oldest are dropped after that
+ACTION_QUEUE_MAX_SIZE = 16
+
+
+class ServiceCall:
+    __slots__ = ('domain', 'service', 'service_data')
+
+    def __init__(self, domain: str, service: str, service_data: dict):
+        self.domain = domain
+        self.service = service
+        self.service_data = dict(service_data or {})
+
+    @property
+    def name(self):
+        return f'{self.domain}.{self.service}'
+
+    @property
+    def target(self) -> Hashable:
+        entity_id = self.service_data.get('entity_id')
+        if isinstance(entity_id, list):
+            return tuple(sorted(entity_id))
+
+        return entity_id
+
+    def merge(self, other: 'ServiceCall') -> bool:
+        ''' Absorb `other`, a call made right after this one. Returns False when they can't be merged '''
+        if other.name != self.name or self.service not in IDEMPOTENT_SERVICES:
+            return False
+
+        # Add up the steps
+        if any(key in self.service_data for key in STEP_KEYS):
+            data = {key: value for key, value in self.service_data.items() if key not in STEP_KEYS}
+            other_data = {key: value for key, value in other.service_data.items() if key not in STEP_KEYS}
+            if data != other_data or set(self.service_data) != set(other.service_data):
+                return False
+
+            for key in STEP_KEYS:
+                if key in self.service_data:
+                    self.service_data[key] += other.service_data[key]
+            return True
+
+        return other.service_data == self.service_data
+
+
+class ActionQueue:
+    '''
+    Sends service calls in the background, so reading the device never waits for Home Assistant.
+    Calls targeting the same entity are sent in order, one at a time, other entities don't wait for them.
+    While a call is in flight, the next identical ones (repeated taps) are merged into a single call.
+    '''
+
+    def __init__(self, call_service: Callable[..., Awaitable], *, on_failed: Callable[[ServiceCall], None] = None):
+        self._call_service = call_service
+        self._on_failed = on_failed
+        # Target -> calls not sent yet
+        self._lanes: Dict[Hashable, Deque[ServiceCall]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def submit(self, *, domain: str, service: str, service_data: dict = None):
+        call = ServiceCall(domain, service, service_data)
+        target = call.target
+
+        lane = self._lanes.get(target)
+        if lane is None:
+            lane = self._lanes[target] = deque()
+            lane.append(call)
+
+            task = asyncio.get_running_loop().create_task(self._run_lane(target, lane))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            return
+
+        # The first call is in flight, only merge with those still waiting
+        if len(lane) > 1 and lane[-1].merge(call):
+            return
+
+        if len(lane) > ACTION_QUEUE_MAX_SIZE:
+            dropped = lane[1]
+            del lane[1]
+            print('⚠️', 'Too many pending actions, dropped', dropped.name, target)
+
+        lane.append(call)
+
+    def cancel(self):
+        ''' Forget pending calls, e.g. when the connection is lost. `on_failed` is called for each of them '''
+        for lane in self._lanes.values():
+            while len(lane) > 1:
+                self._fail(lane.pop())
+
+    def _fail(self, call: ServiceCall):
+        if self._on_failed:
+            try:
+                self._on_failed(call)
+            except Exception:
+                traceback.print_exc()
+
+    async def _run_lane(self, target: Hashable, lane: Deque[ServiceCall]):
+        try:
+            while lane:
+                call = lane[0]
+                try:
+                    await self._call_service(domain=call.domain, service=call.service, service_data=call.service_data)
+                except Exception as e:
+                    # Lost connection, timeout... the next calls are still sent
+                    print('⚠️', call.name, e)
+                    if not isinstance(e, HomeAssistantError):
+                        traceback.print_exc()
+
+                    self._fail(call)
+                finally:
+                    lane.popleft()
+        finally:
+            if self._lanes.get(target) is lane:
+                del self._lanes[target]
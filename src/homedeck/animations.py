@@ -0,0 +1,103 @@
+import asyncio
+import os
+from typing import Callable, Dict, List, Set, Tuple
+
+# Maximum number of frame updates sent to the deck per second.
+# Each update is a USB upload so it competes with other packets.
+ANIMATION_MAX_FPS = float(os.getenv('ANIMATION_MAX_FPS', 4))
+
+
+class _Animation:
+    __slots__ = ('button', 'frames', 'frame_index', 'next_at')
+
+    def __init__(self, button: dict, frames: List[Tuple[str, int]], next_at: float):
+        self.button = button
+        self.frames = frames
+        self.frame_index = 0
+        self.next_at = next_at
+
+
+class AnimationScheduler:
+    '''
+    Sends pre-rendered frames of animated buttons to the deck.
+    All due frames are batched into one update, at most `max_fps` updates per second.
+    '''
+
+    def __init__(self, on_frame: Callable[[Dict[int, dict]], None], *, max_fps: float = ANIMATION_MAX_FPS):
+        self._on_frame = on_frame
+        self._min_interval = 1 / max(max_fps, 0.1)
+
+        self._animations: Dict[int, _Animation] = {}
+        self._is_paused = False
+        self._changed = asyncio.Event()
+
+    def set_buttons(self, buttons: Dict[int, dict], *, update_only=False):
+        ''' Called after sending buttons generated by PageElement.generate() '''
+        if not update_only:
+            self._animations = {}
+
+        now = asyncio.get_running_loop().time()
+        for index, button in buttons.items():
+            frames = button.get('frames') if button else None
+            if not frames:
+                self._animations.pop(index, None)
+                continue
+
+            # Frame #0 is already on the deck
+            button = {key: value for key, value in button.items() if key != 'frames'}
+            self._animations[index] = _Animation(button, frames, now + frames[0][1] / 1000)
+
+        self._changed.set()
+
+    @property
+    def filenames(self) -> Set[str]:
+        ''' Frames of the animations on the deck '''
+        return {filename for animation in self._animations.values() for filename, _ in animation.frames}
+
+    def pause(self):
+        self._is_paused = True
+
+    def resume(self):
+        if self._is_paused:
+            self._is_paused = False
+
+            # Continue from the current frames
+            now = asyncio.get_running_loop().time()
+            for animation in self._animations.values():
+                animation.next_at = now
+
+            self._changed.set()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if self._is_paused or not self._animations:
+                await self._changed.wait()
+                self._changed.clear()
+                continue
+
+            now = loop.time()
+            buttons = {}
+            for index, animation in self._animations.items():
+                if animation.next_at > now:
+                    continue
+
+                animation.frame_index = (animation.frame_index + 1) % len(animation.frames)
+                filename, duration = animation.frames[animation.frame_index]
+                animation.next_at = now + max(duration / 1000, self._min_interval)
+
+                button = dict(animation.button)
+                button['icon'] = filename
+                buttons[index] = button
+
+            if buttons:
+                self._on_frame(buttons)
+
+            # Wait for the next frame, or for changes
+            next_at = min(animation.next_at for animation in self._animations.values())
+            delay = max(next_at - loop.time(), self._min_interval if buttons else 0)
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=delay)
+                self._changed.clear()
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,128 @@
+import json
+import os
+from collections import OrderedDict
+from importlib.metadata import PackageNotFoundError, version
+from typing import Dict, List, Set, Union
+
+from .packager import ZipEntry, build_upload
+
+BUILD_DIR = '.build'
+BUILD_ZIP_PATH = os.path.join(BUILD_DIR, 'build.zip')
+GENERATED_ICONS_DIR = os.path.join('.cache', 'icons', '_generated')
+# Icons that are not on the deck anymore but kept in case they are shown again (animations, state changes...)
+BUILD_MAX_UNUSED_ENTRIES = 256
+# Versions of strmdck whose build step is replaced, the others build uploads themselves
+SUPPORTED_DRIVER_VERSIONS = ('0.1.0rc1',)
+
+
+def _get_driver_version() -> Union[str, None]:
+    try:
+        return version('strmdck')
+    except PackageNotFoundError:
+        return None
+
+
+class BuildDirectory:
+    '''
+    Builds the zip file uploaded by `set_buttons()`, in memory.
+    Icons are compressed once per file name (a digest of their layers) and their entries are reused in later uploads,
+    until they are not used by the buttons on the deck anymore.
+    '''
+
+    def __init__(self):
+        # Icon name -> compressed entry, least recently used first
+        self._entries: OrderedDict[str, ZipEntry] = OrderedDict()
+        # Button index -> icon name, what's currently on the deck
+        self._live_icons: Dict[int, str] = {}
+
+    def reset(self):
+        ''' Called when a device is connected, nothing is on it yet '''
+        self._live_icons = {}
+
+    @property
+    def live_icons(self) -> Set[str]:
+        ''' Names of the icons on the deck '''
+        return {icon_name for icon_name in self._live_icons.values() if icon_name}
+
+    def prepare(self, buttons: Dict, *, columns: int) -> bool:
+        manifest = {}
+        icon_entries = {}
+
+        for button_index, button in buttons.items():
+            button_index = int(button_index)
+            row = button_index // columns
+            index = button_index % columns
+
+            button_data = {
+                'State': 0,
+                'ViewParam': [{}],
+            }
+
+            icon_name = None
+            if button:
+                if 'name' in button:
+                    button_data['ViewParam'][0]['Text'] = button['name']
+
+                if 'icon' in button:
+                    icon_name = button['icon']
+                    icon_entries[icon_name] = self._get_entry(icon_name)
+
+                    button_data['ViewParam'][0]['Icon'] = f'icons/{icon_name}'
+
+            manifest[f'{index}_{row}'] = button_data
+            self._live_icons[button_index] = icon_name
+
+        manifest_data = json.dumps(manifest, sort_keys=True, separators=(',', ':'), indent=2).encode('utf-8')
+        entries = [ZipEntry('manifest.json', manifest_data)] + list(icon_entries.values())
+
+        self._write_zip(entries)
+        self._collect_garbage()
+        return True
+
+    def _get_entry(self, icon_name: str) -> ZipEntry:
+        entry = self._entries.get(icon_name)
+        if not entry:
+            with open(os.path.join(GENERATED_ICONS_DIR, icon_name), 'rb') as fp:
+                entry = ZipEntry(f'icons/{icon_name}', fp.read())
+            self._entries[icon_name] = entry
+
+        self._entries.move_to_end(icon_name)
+        return entry
+
+    def _write_zip(self, entries: List[ZipEntry]):
+        data = build_upload(entries)
+
+        os.makedirs(BUILD_DIR, exist_ok=True)
+        tmp_path = f'{BUILD_ZIP_PATH}.tmp'
+        with open(tmp_path, 'wb') as fp:
+            fp.write(data)
+        os.replace(tmp_path, BUILD_ZIP_PATH)
+
+    def _collect_garbage(self):
+        live_icons = self.live_icons
+
+        unused = [icon_name for icon_name in self._entries if icon_name not in live_icons]
+        for icon_name in unused[:max(len(unused) - BUILD_MAX_UNUSED_ENTRIES, 0)]:
+            del self._entries[icon_name]
+
+
+build_directory = BuildDirectory()
+
+DRIVER_VERSION = _get_driver_version()
+IS_DRIVER_SUPPORTED = DRIVER_VERSION in SUPPORTED_DRIVER_VERSIONS
+if not IS_DRIVER_SUPPORTED:
+    print('⚠️', f'strmdck {DRIVER_VERSION} is not supported, uploads are built by the driver')
+
+
+class InMemoryBuildMixin:
+    '''
+    Mixin for strmdck's devices: uploads are built by `build_directory`,
+    instead of the driver's `_prepare_zip()` which rebuilds `.build` from scratch for every update.
+    Other versions of the driver keep their own build.
+    '''
+
+    def _prepare_zip(self, buttons: Dict) -> bool:
+        if not IS_DRIVER_SUPPORTED:
+            return super()._prepare_zip(buttons)
+
+        return build_directory.prepare(buttons, columns=self.BUTTON_COLS)
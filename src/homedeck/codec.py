@@ -0,0 +1,43 @@
+import json
+import os
+import re
+from typing import Tuple, Union
+
+# "orjson" (default when it's installed) or "json"
+JSON_CODEC = os.getenv('JSON_CODEC', 'orjson')
+
+try:
+    if JSON_CODEC != 'orjson':
+        raise ImportError
+    import orjson
+except ImportError:
+    orjson = None
+
+CODEC_NAME = 'orjson' if orjson else 'json'
+
+# Home Assistant writes "id" and "type" first: {"id":12,"type":"event","event":{...}}
+_MESSAGE_HEADER_PATTERN = re.compile(rb'^\{"id":(\d+),"type":"([a-z_]+)"')
+
+
+def dumps(value) -> bytes:
+    ''' Returns UTF-8 encoded JSON '''
+    if orjson:
+        return orjson.dumps(value)
+
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def loads(data: Union[bytes, str]):
+    if orjson:
+        return orjson.loads(data)
+
+    return json.loads(data)
+
+
+def peek_message(data: bytes) -> Tuple[Union[int, None], Union[str, None]]:
+    ''' Reads "id" and "type" of a Home Assistant message without parsing it, (None, None) when unknown '''
+    match = _MESSAGE_HEADER_PATTERN.match(data[:64])
+    if not match:
+        return None, None
+
+    return int(match.group(1)), match.group(2).decode('ascii')
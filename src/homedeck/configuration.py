@@ -1,6 +1,8 @@
 from __future__ import annotations
 
 import os
+import re
+from typing import Union
 
 import jsonschema
 import jsonschema.exceptions
@@ -9,15 +11,35 @@ from strmdck.device import DeckDevice
 
 from .dataclasses import MainConfig
 from .elements import PageElement
+from .enums import IconSource
+
+ENTITY_ID_PATTERN = re.compile(r'^[a-z0-9_]+\.[a-z0-9_]+$')
+# Entities used in templates, e.g. states('sensor.temperature'), is_state("light.kitchen", "on")
+TEMPLATE_ENTITY_PATTERN = re.compile(r'''\b(?:states|state_attr|is_state|binary_text)\(\s*['"]([a-z0-9_]+\.[a-z0-9_]+)['"]''')
+TEMPLATE_ENTITY_CALL_PATTERN = re.compile(r'\b(?:states|state_attr|is_state|binary_text)\(')
+# Attributes used in templates, e.g. state_attr('light.kitchen', 'brightness'), self_state_attr('unit_of_measurement')
+TEMPLATE_ATTRIBUTE_PATTERN = re.compile(r'''\b(?:state_attr\(\s*['"][a-z0-9_]+\.[a-z0-9_]+['"]\s*,|self_state_attr\()\s*['"]([^'"]+)['"]''')
+TEMPLATE_ATTRIBUTE_CALL_PATTERN = re.compile(r'\b(?:self_)?state_attr\(')
 
 
 class Configuration:
     def __init__(self, *, device: DeckDevice, source_dict: dict, all_states: dict):
         self._device = device
         self._config_dict = source_dict
+        self._referenced_entities = frozenset()
+        self._referenced_attributes = frozenset()
 
         self._is_valid = self._validate()
         if self._is_valid:
+            # Before `pages` are replaced by PageConfig objects
+            entities = set()
+            attributes = set()
+            Configuration._find_entities(self._config_dict, entities, attributes)
+            # None: an entity ID is not a literal, receive all of them
+            self._referenced_entities = None if None in entities else frozenset(entities)
+            # None: an attribute name is not a literal, keep all of them
+            self._referenced_attributes = None if None in attributes else frozenset(attributes)
+
             self._post_process(all_states=all_states)
 
     def _validate(self):
@@ -54,6 +76,10 @@ class Configuration:
     def sleep(self):
         return self._config.sleep
 
+    @property
+    def optimistic(self):
+        return self._config.optimistic
+
     @property
     def system_buttons(self):
         return self._config.system_buttons
@@ -62,15 +88,57 @@ class Configuration:
     def presets(self):
         return self._config_dict.get('presets', {})
 
+    @property
+    def referenced_entities(self) -> Union[frozenset, None]:
+        ''' IDs of all entities used by buttons, actions, templates and pictures, None when they can't all be found '''
+        return self._referenced_entities
+
+    @property
+    def referenced_attributes(self) -> Union[frozenset, None]:
+        ''' Names of attributes read by templates, None when they can't all be found '''
+        return self._referenced_attributes
+
+    @staticmethod
+    def _find_entities(source, entities: set, attributes: set):
+        if isinstance(source, dict):
+            for key, value in source.items():
+                if key == 'entity_id':
+                    for entity_id in (value if isinstance(value, list) else [value]):
+                        if isinstance(entity_id, str) and ENTITY_ID_PATTERN.match(entity_id):
+                            entities.add(entity_id)
+
+                Configuration._find_entities(value, entities, attributes)
+        elif isinstance(source, list):
+            for value in source:
+                Configuration._find_entities(value, entities, attributes)
+        elif isinstance(source, str):
+            entity_ids = TEMPLATE_ENTITY_PATTERN.findall(source)
+            entities.update(entity_ids)
+            if len(entity_ids) < len(TEMPLATE_ENTITY_CALL_PATTERN.findall(source)):
+                entities.add(None)
+
+            names = TEMPLATE_ATTRIBUTE_PATTERN.findall(source)
+            attributes.update(names)
+            if len(names) < len(TEMPLATE_ATTRIBUTE_CALL_PATTERN.findall(source)):
+                attributes.add(None)
+
+            # picture:<entity_id>
+            prefix = f'{IconSource.PICTURE.value}:'
+            if source.startswith(prefix) and ENTITY_ID_PATTERN.match(source[len(prefix):]):
+                entities.add(source[len(prefix):])
+
     @property
     def page_elements(self):
         return self._page_elements
 
     def get_page_element(self, page_id: str) -> PageElement:
-        if page_id in self._page_elements:
-            return self._page_elements[page_id]
+        page_config = self._config.get_page(page_id)
+
+        page_element = self._page_elements.get(page_id)
+        if page_element and page_element.page_config is page_config:
+            return page_element
 
-        page_element = PageElement(self._config.pages[page_id])
+        page_element = PageElement(page_config)
         self._page_elements[page_id] = page_element
 
         return page_element
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 import copy
-from dataclasses import dataclass, field, fields
+from dataclasses import MISSING, FrozenInstanceError, dataclass, field, fields
 from typing import Dict, List, Optional, Tuple, Union
 
 from deepdiff import DeepDiff
@@ -93,6 +93,7 @@ class PageButtonConfig:
     icon_border_width: Optional[int] = field(default=None, metadata={'icon': True})
     icon_border_color: Optional[str] = field(default=None, metadata={'icon': True})
     icon_brightness: Optional[int] = field(default=None, metadata={'icon': True})
+    icon_animation: Optional[str] = field(default=None, metadata={'icon': True})
 
     max_width: Optional[int] = field(default=0, metadata={'icon': True})
     max_height: Optional[int] = field(default=0, metadata={'icon': True})
@@ -201,6 +202,68 @@ ICON_FIELDS = [field.name for field in fields(PageButtonConfig) if field.metadat
 TEXT_ICON_FIELDS = [field.name for field in fields(PageButtonConfig) if field.metadata and field.metadata.get('text_icon')]
 
 
+# Default values of PageButtonConfig's fields, in declaration order
+_BUTTON_DEFAULTS = {button_field.name: button_field.default for button_field in fields(PageButtonConfig) if button_field.default_factory is MISSING}
+_BUTTON_DEFAULT_FACTORIES = {button_field.name: button_field.default_factory for button_field in fields(PageButtonConfig) if button_field.default_factory is not MISSING}
+_BUTTON_FIELDS = tuple(button_field.name for button_field in fields(PageButtonConfig))
+_BUTTON_INIT_FIELDS = frozenset(button_field.name for button_field in fields(PageButtonConfig) if button_field.init)
+
+_ICON_ONLY_FIELDS = tuple(ICON_FIELDS)
+_TEXT_ICON_ONLY_FIELDS = tuple(key for key in TEXT_ICON_FIELDS if key not in ICON_FIELDS)
+
+
+class FrozenPageButtonConfig:
+    ''' Slotted, immutable version of PageButtonConfig used for rendering '''
+    __slots__ = _BUTTON_FIELDS + ('icon_fields', 'text_icon_fields')
+
+    def __init__(self, **kwargs):
+        if not _BUTTON_INIT_FIELDS.issuperset(kwargs):
+            unknown_fields = kwargs.keys() - _BUTTON_INIT_FIELDS
+            raise TypeError(f'Unexpected button fields: {", ".join(sorted(unknown_fields))}')
+
+        values = {**_BUTTON_DEFAULTS, **kwargs}
+        for name, factory in _BUTTON_DEFAULT_FACTORIES.items():
+            if name not in kwargs:
+                values[name] = factory()
+
+        # Copy action's data so the source dict isn't modified
+        entity_id = values['entity_id']
+        for action_key in ('tap_action', 'hold_action'):
+            action = values[action_key]
+            if action:
+                action = dict(action)
+                if isinstance(action.get('data'), dict):
+                    action['data'] = dict(action['data'])
+
+                values[action_key] = PageButtonActionConfig(entity_id=entity_id, **action)
+
+        # Normalize presets
+        presets = values['presets']
+        if not presets:
+            values['presets'] = []
+        elif not isinstance(presets, list):
+            values['presets'] = [presets]
+
+        setter = object.__setattr__
+        for name in _BUTTON_FIELDS:
+            setter(self, name, values[name])
+
+        # Non-None (field, value) pairs of the main icon and the text icon.
+        # Fields shared by both (Material You) belong to the main icon.
+        setter(self, 'icon_fields', tuple((key, values[key]) for key in _ICON_ONLY_FIELDS if values[key] is not None))
+        setter(self, 'text_icon_fields', tuple((key, values[key]) for key in _TEXT_ICON_ONLY_FIELDS if values[key] is not None))
+
+    def __setattr__(self, name, value):
+        raise FrozenInstanceError(f'cannot assign to field {name!r}')
+
+    def __delattr__(self, name):
+        raise FrozenInstanceError(f'cannot delete field {name!r}')
+
+    def __repr__(self):
+        values = ', '.join(f'{name}={getattr(self, name)!r}' for name in _BUTTON_FIELDS)
+        return f'{self.__class__.__name__}({values})'
+
+
 @dataclass(init=False)
 class PageConfig:
     id: str
@@ -216,8 +279,13 @@ class PageConfig:
 
         # Set `buttons` string to buttons_raw
         self.buttons_raw = copy.deepcopy(buttons)
+        self.is_set_up = False
+        # Sensors without states when set up, their device_class presets are missing
+        self._entities_without_states = set()
 
     def post_setup(self, *, device: 'DeckDevice', main_config: MainConfig, all_states: dict, presets_config={}):
+        self.is_set_up = True
+
         # Merge button positions
         self.button_positions = normalize_button_positions(self.button_positions or {})
         # TODO: FIX this
@@ -225,8 +293,18 @@ class PageConfig:
 
         # Transform button_raws
         for index, button in enumerate(self.buttons_raw):
+            if isinstance(button, dict) and 'presets' not in button:
+                entity_id = button.get('entity_id') or ''
+                domain = button.get('domain') or entity_id.split('.')[0]
+                if domain in ('binary_sensor', 'sensor') and entity_id not in all_states:
+                    self._entities_without_states.add(entity_id)
+
             self.buttons_raw[index] = PageButtonConfig.transform(button, device=device, all_states=all_states, presets_config=presets_config)
 
+    def is_outdated(self, all_states: dict) -> bool:
+        ''' True when states of sensors were received after it was set up '''
+        return any(entity_id in all_states for entity_id in self._entities_without_states)
+
 
 @dataclass
 class SystemButtonConfig:
@@ -239,6 +317,7 @@ class MainConfig:
     brightness: int = field(default=100)
     label_style: LabelStyleConfig = None
     sleep: SleepConfig = None
+    optimistic: bool = field(default=False)
 
     pages: Dict[str, PageConfig] = field(default_factory=lambda: {})
     presets: Dict[str, Dict] = field(default_factory=lambda: {})
@@ -266,18 +345,31 @@ class MainConfig:
             self.system_buttons[ButtonElementAction(key)] = SystemButtonConfig(**value)
             del self.system_buttons[key]
 
-        # Setup pages
+        # Pages are transformed lazily in get_page()
+        self._device = device
+        self._all_states = all_states
+        # Page ID -> page's dict from the configuration file
+        self._pages_source = dict(self.pages)
+
         for page_id, page_value in self.pages.items():
-            page_config = PageConfig(id=page_id, **page_value)
-            page_config.post_setup(device=device, main_config=self, all_states=all_states, presets_config=self.presets)
+            self.pages[page_id] = PageConfig(id=page_id, **page_value)
+
+    def get_page(self, page_id: str) -> PageConfig:
+        ''' Returns a new PageConfig when the page must be set up again '''
+        page_config = self.pages[page_id]
+        if page_config.is_set_up and page_config.is_outdated(self._all_states):
+            page_config = self.pages[page_id] = PageConfig(id=page_id, **self._pages_source[page_id])
+
+        if not page_config.is_set_up:
+            page_config.post_setup(device=self._device, main_config=self, all_states=self._all_states, presets_config=self.presets)
 
-            self.pages[page_id] = page_config
+        return page_config
 
     def __eq__(self, other: MainConfig):
-        same = self.brightness == other.brightness and self.label_style == other.label_style and self.sleep == other.sleep and not DeepDiff(self.presets, other.presets)
+        same = self.brightness == other.brightness and self.optimistic == other.optimistic and self.label_style == other.label_style and self.sleep == other.sleep and not DeepDiff(self.presets, other.presets)
         if not same:
             return False
 
-        # Compage pages
-        diff = DeepDiff(self.pages, other.pages)
+        # Compare pages as they are in the configuration files, without setting them up
+        diff = DeepDiff(self._pages_source, other._pages_source)
         return not diff
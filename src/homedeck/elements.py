@@ -1,27 +1,27 @@
 from __future__ import annotations
 
 import os
-import shutil
-from copy import deepcopy
+from collections import ChainMap
 from typing import Dict
 
 from deepdiff import DeepDiff
 
 from .dataclasses import (
+    FrozenPageButtonConfig,
     PageButtonActionConfig,
-    PageButtonConfig,
     PageConfig,
     SystemButtonConfig,
 )
-from .enums import ButtonElementAction, InteractionType
+from .enums import ButtonElementAction, IconSource, InteractionType
 from .icons import icon_provider
+from .pictures import picture_provider
 from .template import render_template
-from .utils import deep_merge
+from .utils import merged
 
 
 class ButtonElement:
-    def __init__(self, button_config: PageButtonConfig):
-        self._config: PageButtonConfig = button_config
+    def __init__(self, button_config: FrozenPageButtonConfig):
+        self._config: FrozenPageButtonConfig = button_config
         self._actions: Dict[InteractionType, PageButtonActionConfig] = {}
 
         if button_config.tap_action:
@@ -57,7 +57,7 @@ class ButtonElement:
             deck.page_go_to(main_action.data)
         else:
             domain, action = action.split('.')
-            await deck.call_ha_service(domain=domain, service=action, service_data=main_action.data)
+            deck.call_ha_service(domain=domain, service=action, service_data=main_action.data)
         return True
 
 
@@ -67,6 +67,8 @@ class PageElement:
         self._button_elements: Dict[ButtonElement] = {}
         self._button_raws = {}
         self._changed_button_elements = {}
+        # (button index, state) of variants already rendered
+        self._rendered_variants = set()
 
     @property
     def buttons(self) -> Dict[int, ButtonElement]:
@@ -87,7 +89,7 @@ class PageElement:
     def _to_button_element(self, button):
         button_element = None
         if button:
-            button_config = PageButtonConfig(**deepcopy(button))
+            button_config = FrozenPageButtonConfig(**button)
             button_element = ButtonElement(button_config)
 
         return button_element
@@ -103,42 +105,96 @@ class PageElement:
         self._button_raws[index] = button
         self._button_elements[index] = self._to_button_element(button)
 
+    @staticmethod
+    def _apply_entity_state(button: dict, *, entity_id: str, all_states: dict) -> dict:
+        ''' Use the entity's icon and name, apply presets of its current state. `button` is not modified '''
+        states = all_states.get(entity_id)
+        if not states:
+            return button
+
+        button = dict(button)
+        if 'icon' not in button:
+            # Use icon in states
+            icon = states.get('attributes', {}).get('icon')
+            if icon:
+                button['icon'] = icon
+
+        # Apply presets based on state
+        state = states.get('state')
+        if state and 'states' in button and state in button['states']:
+            button = merged(button, button['states'][state])
+
+        # Get default name
+        if 'name' not in button:
+            button['name'] = states.get('attributes', {}).get('friendly_name')
+
+        return button
+
+    @staticmethod
+    def _is_picture_icon(icon) -> bool:
+        return isinstance(icon, str) and icon.startswith(f'{IconSource.PICTURE.value}:')
+
+    def state_variants(self, *, all_states: dict):
+        '''
+        Yields configs of buttons in their other declared states, to be rendered ahead of time.
+        A state change then reuses an icon in icon_provider's cache instead of rasterizing it.
+        Templates are rendered with the predicted state, a wrong guess only means a cache miss.
+        Each variant is only yielded once.
+        '''
+        for index, button in enumerate(self._page_config.buttons_raw):
+            if not button or not button.get('states') or not button.get('entity_id'):
+                continue
+
+            entity_id = button['entity_id']
+            entity_states = all_states.get(entity_id)
+            if not entity_states:
+                continue
+
+            for state in button['states']:
+                if state == entity_states.get('state') or (index, state) in self._rendered_variants:
+                    continue
+
+                # Don't copy all states for one change
+                predicted_states = ChainMap({entity_id: {**entity_states, 'state': state}}, all_states)
+                variant = PageElement._apply_entity_state(button, entity_id=entity_id, all_states=predicted_states)
+                variant = render_template(variant, predicted_states, entity_id=entity_id)
+                visibility = variant.get('visibility', True)
+                if PageElement._is_picture_icon(variant.get('icon')) or visibility not in (True, 'True', 'visible'):
+                    self._rendered_variants.add((index, state))
+                    continue
+
+                yield FrozenPageButtonConfig(**variant)
+                # Not reached when the consumer is cancelled before rendering it
+                self._rendered_variants.add((index, state))
+
     def render_buttons(self, *, system_buttons: Dict[ButtonElementAction, SystemButtonConfig], page_number: int = 1, is_sub_page: bool = False, buttons_per_page=0, all_states=dict) -> bool:
         old_raws = self._button_raws
         new_raws = {}
         self._button_elements = {}
 
         total_skipped = 0
-        for index, button in enumerate(deepcopy(self._page_config.buttons_raw)):
+        # Buttons of the config are read-only, they are copied when they are modified
+        for index, button in enumerate(self._page_config.buttons_raw):
             if not button:
                 new_raws[index] = None
                 continue
 
             # Get entity_id for self_*() mixins
-            entity_id = None
-            if 'entity_id' in button:
-                entity_id = button['entity_id']
-                states = all_states.get(entity_id)
-                if states:
-                    if 'icon' not in button:
-                        # Use icon in states
-                        icon = states.get('attributes', {}).get('icon')
-                        if icon:
-                            button['icon'] = icon
-
-                    # Apply presets based on state
-                    state = states.get('state')
-                    if state and 'states' in button and state in button['states']:
-                        button = deep_merge(button, button['states'][state])
-
-                    # Get default name
-                    if 'name' not in button:
-                        button['name'] = states.get('attributes', {}).get('friendly_name')
+            entity_id = button.get('entity_id')
+            if entity_id:
+                button = PageElement._apply_entity_state(button, entity_id=entity_id, all_states=all_states)
 
             # Render templates
             if button.get('is_dynamic'):
                 button = render_template(button, entity_id=entity_id, all_states=all_states)
 
+            # Replace "picture:<entity_id>" with the digest of its downloaded picture
+            icon = button.get('icon')
+            if PageElement._is_picture_icon(icon):
+                picture_entity_id = icon.split(':', 1)[1] or entity_id
+                digest = picture_provider.resolve(picture_entity_id, all_states=all_states, size=(button['max_width'], button['max_height'])) if picture_entity_id else ''
+                button = {**button, 'icon': f'{IconSource.PICTURE.value}:{digest}'}
+
             # Check visibility
             visibility = button.get('visibility', True)
             is_hidden = visibility is False or visibility == 'False' or visibility == 'hidden'
@@ -233,11 +289,12 @@ class PageElement:
             icon_name = icon.generated_filename()
             icon_path = os.path.join('.cache', 'icons', '_generated', icon_name)
             if os.path.exists(icon_path):
-                # Copy icon
-                icons_build_path = os.path.join('.build', 'page', 'icons')
-                os.makedirs(icons_build_path, exist_ok=True)
-                shutil.copyfile(icon_path, os.path.join(icons_build_path, icon_name))
+                # Linked into .build by build_directory
                 output[index]['icon'] = icon_name
 
+                # Animated icon, frames are sent by AnimationScheduler
+                if icon.frames:
+                    output[index]['frames'] = icon.frames
+
         print('page', output)
         return output
@@ -0,0 +1,492 @@
+'''
+A stand-in for Home Assistant's websocket API, to run HomeDeck (or load tests) without a real instance.
+
+    python -m homedeck.fake_home_assistant --entities 2000 --storm-rate 200
+
+Then start HomeDeck with `HA_HOST=ws://127.0.0.1:8123` and `HA_ACCESS_TOKEN=fake-token`.
+
+Supported commands: auth, ping, get_states, subscribe_events, subscribe_entities, unsubscribe_events, call_service.
+'''
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Set, Union
+
+import websockets
+
+from . import codec
+
+FAKE_HA_PORT = 8123
+FAKE_HA_TOKEN = 'fake-token'
+FAKE_HA_VERSION = '2025.1.0'
+
+# Share of each domain in generated populations
+POPULATION_DOMAINS = {
+    'light': 0.3,
+    'switch': 0.2,
+    'fan': 0.05,
+    'sensor': 0.35,
+    'binary_sensor': 0.1,
+}
+# Domains with "on"/"off" states, controlled by turn_on, turn_off and toggle
+TOGGLE_DOMAINS = {'light', 'switch', 'fan', 'input_boolean', 'binary_sensor'}
+
+
+def _iso_time(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+
+
+def _context_id() -> str:
+    return uuid.uuid4().hex[:26].upper()
+
+
+class _Client:
+    __slots__ = ('ws', 'queue', 'subscriptions')
+
+    def __init__(self, ws):
+        self.ws = ws
+        # Messages are sent in order by a single writer
+        self.queue: asyncio.Queue = asyncio.Queue()
+        # Subscription ID -> ('events', event type or None) or ('entities', entity IDs or None)
+        self.subscriptions: Dict[int, tuple] = {}
+
+
+class FakeHomeAssistant:
+    '''
+    Keeps full states like Home Assistant does and sends their changes to subscribed clients.
+    States are changed by service calls, `set_state()` and `storm()`.
+    '''
+
+    def __init__(self, *, token: str = FAKE_HA_TOKEN, service_latency: float = 0, drop_rate: float = 0, seed: int = None):
+        self.token = token
+        # Seconds before the state changed by a service call is reported, like a slow Zigbee device
+        self.service_latency = service_latency
+        # Share of service calls which succeed but never change the state
+        self.drop_rate = drop_rate
+
+        self._random = random.Random(seed)
+        self._states: Dict[str, dict] = {}
+        # Compressed states' context IDs and timestamps
+        self._meta: Dict[str, dict] = {}
+        self._clients: Set[_Client] = set()
+
+        self.stats = {
+            'messages_received': 0,
+            'messages_sent': 0,
+            'state_changes': 0,
+            'service_calls': 0,
+        }
+
+    @property
+    def states(self) -> Dict[str, dict]:
+        return self._states
+
+    def populate(self, count: int, *, extra_attributes: int = 0) -> List[str]:
+        ''' Adds `count` entities of various domains, each with `extra_attributes` padding attributes '''
+        domains = list(POPULATION_DOMAINS)
+        weights = list(POPULATION_DOMAINS.values())
+
+        entity_ids = []
+        for _ in range(count):
+            domain = self._random.choices(domains, weights)[0]
+            entity_id = f'{domain}.fake_{len(self._states) + 1}'
+            state, attributes = self._initial_state(domain, entity_id)
+            for index in range(extra_attributes):
+                attributes[f'attr_{index}'] = f'value {index}'
+
+            self.set_state(entity_id, state, attributes)
+            entity_ids.append(entity_id)
+
+        return entity_ids
+
+    def load_states(self, states: Iterable[dict]):
+        ''' Adds states saved from a real instance (result of get_states) '''
+        for state in states:
+            self.set_state(state['entity_id'], state['state'], state.get('attributes', {}))
+
+    def _initial_state(self, domain: str, entity_id: str):
+        name = entity_id.split('.', 1)[1].replace('_', ' ').title()
+        attributes = {'friendly_name': name}
+
+        if domain == 'light':
+            state = self._random.choice(['on', 'off'])
+            attributes.update({
+                'supported_color_modes': ['brightness'],
+                'color_mode': 'brightness' if state == 'on' else None,
+                'brightness': self._random.randint(1, 255) if state == 'on' else None,
+            })
+        elif domain == 'sensor':
+            state = f'{self._random.uniform(15, 30):.1f}'
+            attributes.update({
+                'device_class': 'temperature',
+                'state_class': 'measurement',
+                'unit_of_measurement': '°C',
+            })
+        elif domain == 'binary_sensor':
+            state = self._random.choice(['on', 'off'])
+            attributes['device_class'] = 'motion'
+        else:
+            state = self._random.choice(['on', 'off'])
+
+        return state, attributes
+
+    def set_state(self, entity_id: str, state: str = None, attributes: dict = None, *, context_id: str = None):
+        '''
+        Changes the state and/or attributes of `entity_id` (created when it doesn't exist)
+        and sends the change to subscribed clients.
+        '''
+        now = time.time()
+        old_state = self._states.get(entity_id)
+        old_meta = self._meta.get(entity_id)
+
+        if old_state:
+            new_state_value = old_state['state'] if state is None else str(state)
+            new_attributes = {**old_state['attributes'], **(attributes or {})}
+            # Unchanged
+            if new_state_value == old_state['state'] and new_attributes == old_state['attributes']:
+                return
+        else:
+            new_state_value = 'unknown' if state is None else str(state)
+            new_attributes = dict(attributes or {})
+
+        is_state_changed = not old_state or new_state_value != old_state['state']
+        meta = {
+            'c': context_id or _context_id(),
+            'lc': now if is_state_changed else old_meta['lc'],
+            'lu': now,
+        }
+        new_state = {
+            'entity_id': entity_id,
+            'state': new_state_value,
+            'attributes': new_attributes,
+            'last_changed': _iso_time(meta['lc']),
+            'last_reported': _iso_time(now),
+            'last_updated': _iso_time(now),
+            'context': {'id': meta['c'], 'parent_id': None, 'user_id': None},
+        }
+        self._states[entity_id] = new_state
+        self._meta[entity_id] = meta
+        self.stats['state_changes'] += 1
+
+        self._dispatch(entity_id, old_state, new_state)
+
+    def remove_entity(self, entity_id: str):
+        old_state = self._states.pop(entity_id, None)
+        self._meta.pop(entity_id, None)
+        if old_state:
+            self._dispatch(entity_id, old_state, None)
+
+    def random_change(self):
+        ''' Changes a random entity, like a busy house does '''
+        if not self._states:
+            return
+
+        entity_id = self._random.choice(list(self._states))
+        state = self._states[entity_id]
+        domain = entity_id.split('.', 1)[0]
+
+        if domain == 'sensor':
+            try:
+                value = float(state['state']) + self._random.uniform(-0.5, 0.5)
+            except ValueError:
+                value = 20
+            self.set_state(entity_id, f'{value:.1f}')
+        elif domain == 'light' and state['state'] == 'on' and self._random.random() < 0.5:
+            self.set_state(entity_id, attributes={'brightness': self._random.randint(1, 255)})
+        elif state['state'] in ('on', 'off'):
+            self._toggle(entity_id)
+        else:
+            self.set_state(entity_id, attributes={'fake_counter': state['attributes'].get('fake_counter', 0) + 1})
+
+    async def storm(self, rate: float, *, duration: float = None, entity_ids: List[str] = None):
+        '''
+        Changes `rate` random entities per second, for `duration` seconds (forever when None).
+        Changes are made in batches, so high rates don't depend on the timer's resolution.
+        '''
+        loop = asyncio.get_running_loop()
+        started_at = last_at = loop.time()
+        pending = 0.0
+
+        while duration is None or last_at - started_at < duration:
+            await asyncio.sleep(0.01)
+
+            now = loop.time()
+            pending += (now - last_at) * rate
+            last_at = now
+
+            while pending >= 1:
+                pending -= 1
+                if entity_ids:
+                    entity_id = self._random.choice(entity_ids)
+                    if self._states.get(entity_id, {}).get('state') in ('on', 'off'):
+                        self._toggle(entity_id)
+                else:
+                    self.random_change()
+
+    def _toggle(self, entity_id: str, *, context_id: str = None):
+        state = 'off' if self._states[entity_id]['state'] == 'on' else 'on'
+        self._set_on_off(entity_id, state, context_id=context_id)
+
+    def _set_on_off(self, entity_id: str, state: str, *, attributes: dict = None, context_id: str = None):
+        attributes = dict(attributes or {})
+        if entity_id.startswith('light.'):
+            if state == 'off':
+                attributes.update({'brightness': None, 'color_mode': None})
+            else:
+                attributes.setdefault('brightness', self._states[entity_id]['attributes'].get('brightness') or 255)
+                attributes['color_mode'] = 'brightness'
+
+        self.set_state(entity_id, state, attributes, context_id=context_id)
+
+    def _dispatch(self, entity_id: str, old_state: Union[dict, None], new_state: Union[dict, None]):
+        if not self._clients:
+            return
+
+        event = None
+        compressed = None
+        for client in self._clients:
+            for subscription_id, (kind, target) in client.subscriptions.items():
+                if kind == 'events':
+                    if target not in (None, 'state_changed'):
+                        continue
+
+                    if event is None:
+                        event = {
+                            'event_type': 'state_changed',
+                            'data': {'entity_id': entity_id, 'old_state': old_state, 'new_state': new_state},
+                            'origin': 'LOCAL',
+                            'time_fired': (new_state or old_state)['last_updated'],
+                            'context': (new_state or old_state)['context'],
+                        }
+                    client.queue.put_nowait({'id': subscription_id, 'type': 'event', 'event': event})
+                elif target is None or entity_id in target:
+                    if compressed is None:
+                        compressed = self._compress_change(entity_id, old_state, new_state)
+                    client.queue.put_nowait({'id': subscription_id, 'type': 'event', 'event': compressed})
+
+    def _compress_state(self, entity_id: str) -> dict:
+        state = self._states[entity_id]
+        meta = self._meta[entity_id]
+
+        compressed = {'s': state['state'], 'a': state['attributes'], 'c': meta['c'], 'lc': meta['lc']}
+        if meta['lu'] != meta['lc']:
+            compressed['lu'] = meta['lu']
+        return compressed
+
+    def _compress_change(self, entity_id: str, old_state: Union[dict, None], new_state: Union[dict, None]) -> dict:
+        ''' Same format as Home Assistant's subscribe_entities '''
+        if new_state is None:
+            return {'r': [entity_id]}
+
+        if old_state is None:
+            return {'a': {entity_id: self._compress_state(entity_id)}}
+
+        meta = self._meta[entity_id]
+        to_add = {'c': meta['c']}
+        if new_state['state'] != old_state['state']:
+            to_add['s'] = new_state['state']
+            to_add['lc'] = meta['lc']
+        else:
+            to_add['lu'] = meta['lu']
+
+        old_attributes = old_state['attributes']
+        new_attributes = new_state['attributes']
+        changed = {key: value for key, value in new_attributes.items() if key not in old_attributes or old_attributes[key] != value}
+        if changed:
+            to_add['a'] = changed
+
+        diff = {'+': to_add}
+        removed = [key for key in old_attributes if key not in new_attributes]
+        if removed:
+            diff['-'] = {'a': removed}
+
+        return {'c': {entity_id: diff}}
+
+    async def serve(self, host: str = '127.0.0.1', port: int = FAKE_HA_PORT):
+        async with websockets.serve(self._handle_client, host, port, max_size=None):
+            await asyncio.Future()
+
+    async def _handle_client(self, ws):
+        await ws.send(codec.dumps({'type': 'auth_required', 'ha_version': FAKE_HA_VERSION}), text=True)
+
+        try:
+            message = codec.loads(await ws.recv(decode=False))
+        except websockets.exceptions.ConnectionClosed:
+            return
+
+        if message.get('type') != 'auth' or message.get('access_token') != self.token:
+            await ws.send(codec.dumps({'type': 'auth_invalid', 'message': 'Invalid access token or password'}), text=True)
+            return
+
+        await ws.send(codec.dumps({'type': 'auth_ok', 'ha_version': FAKE_HA_VERSION}), text=True)
+
+        client = _Client(ws)
+        self._clients.add(client)
+        writer = asyncio.get_running_loop().create_task(self._write_messages(client))
+        try:
+            async for data in ws:
+                self.stats['messages_received'] += 1
+                try:
+                    message = codec.loads(data)
+                    self._handle_message(client, message)
+                except Exception as e:
+                    print('Fake Home Assistant: invalid message', e)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            self._clients.discard(client)
+            writer.cancel()
+
+    async def _write_messages(self, client: _Client):
+        try:
+            while True:
+                message = await client.queue.get()
+                await client.ws.send(codec.dumps(message), text=True)
+                self.stats['messages_sent'] += 1
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    def _send_result(self, client: _Client, message_id: int, result=None):
+        client.queue.put_nowait({'id': message_id, 'type': 'result', 'success': True, 'result': result})
+
+    def _send_error(self, client: _Client, message_id: int, code: str, error: str):
+        client.queue.put_nowait({'id': message_id, 'type': 'result', 'success': False, 'error': {'code': code, 'message': error}})
+
+    def _handle_message(self, client: _Client, message: dict):
+        message_id = message.get('id')
+        message_type = message.get('type')
+
+        if message_type == 'ping':
+            client.queue.put_nowait({'id': message_id, 'type': 'pong'})
+        elif message_type == 'get_states':
+            self._send_result(client, message_id, list(self._states.values()))
+        elif message_type == 'subscribe_events':
+            client.subscriptions[message_id] = ('events', message.get('event_type'))
+            self._send_result(client, message_id)
+        elif message_type == 'subscribe_entities':
+            entity_ids = message.get('entity_ids')
+            entity_ids = set(entity_ids) if entity_ids else None
+            client.subscriptions[message_id] = ('entities', entity_ids)
+            self._send_result(client, message_id)
+
+            # Current states first
+            added = {entity_id: self._compress_state(entity_id) for entity_id in self._states if entity_ids is None or entity_id in entity_ids}
+            client.queue.put_nowait({'id': message_id, 'type': 'event', 'event': {'a': added}})
+        elif message_type == 'unsubscribe_events':
+            if client.subscriptions.pop(message.get('subscription'), None):
+                self._send_result(client, message_id)
+            else:
+                self._send_error(client, message_id, 'not_found', 'Subscription not found.')
+        elif message_type == 'call_service':
+            self._call_service(client, message)
+        else:
+            self._send_error(client, message_id, 'unknown_command', 'Unknown command.')
+
+    def _call_service(self, client: _Client, message: dict):
+        message_id = message.get('id')
+        domain = message.get('domain')
+        service = message.get('service')
+        service_data = message.get('service_data') or {}
+        self.stats['service_calls'] += 1
+
+        known_domains = {entity_id.split('.', 1)[0] for entity_id in self._states} | {'homeassistant'}
+        if domain not in known_domains:
+            self._send_error(client, message_id, 'not_found', f'Service {domain}.{service} not found.')
+            return
+
+        entity_ids = service_data.get('entity_id') or []
+        if isinstance(entity_ids, str):
+            entity_ids = [entity_id.strip() for entity_id in entity_ids.split(',')]
+
+        context_id = _context_id()
+        self._send_result(client, message_id, {'context': {'id': context_id, 'parent_id': None, 'user_id': None}})
+
+        if service not in ('turn_on', 'turn_off', 'toggle') or self._random.random() < self.drop_rate:
+            return
+
+        def apply():
+            for entity_id in entity_ids:
+                state = self._states.get(entity_id)
+                if not state or entity_id.split('.', 1)[0] not in TOGGLE_DOMAINS:
+                    continue
+
+                if service == 'toggle':
+                    self._toggle(entity_id, context_id=context_id)
+                elif service == 'turn_off':
+                    self._set_on_off(entity_id, 'off', context_id=context_id)
+                else:
+                    self._set_on_off(entity_id, 'on', attributes=self._light_attributes(entity_id, service_data), context_id=context_id)
+
+        if self.service_latency > 0:
+            asyncio.get_running_loop().call_later(self.service_latency, apply)
+        else:
+            apply()
+
+    def _light_attributes(self, entity_id: str, service_data: dict) -> dict:
+        if not entity_id.startswith('light.'):
+            return {}
+
+        brightness = self._states[entity_id]['attributes'].get('brightness') or 0
+        if 'brightness' in service_data:
+            brightness = service_data['brightness']
+        elif 'brightness_pct' in service_data:
+            brightness = round(service_data['brightness_pct'] * 255 / 100)
+        elif 'brightness_step' in service_data:
+            brightness += service_data['brightness_step']
+        elif 'brightness_step_pct' in service_data:
+            brightness += round(service_data['brightness_step_pct'] * 255 / 100)
+        else:
+            return {}
+
+        return {'brightness': max(1, min(255, brightness))}
+
+    async def print_stats(self, interval: float = 10):
+        last_stats = dict(self.stats)
+        while True:
+            await asyncio.sleep(interval)
+
+            rates = ', '.join(f'{key}: {(value - last_stats[key]) / interval:.1f}/s' for key, value in self.stats.items())
+            backlog = sum(client.queue.qsize() for client in self._clients)
+            print(f'{len(self._clients)} client(s), {rates}, backlog: {backlog}')
+            last_stats = dict(self.stats)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Fake Home Assistant websocket server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=FAKE_HA_PORT)
+    parser.add_argument('--token', default=FAKE_HA_TOKEN, help='Expected access token')
+    parser.add_argument('--states', help='JSON file with the result of get_states from a real instance')
+    parser.add_argument('--entities', type=int, default=100, help='Number of generated entities')
+    parser.add_argument('--attributes', type=int, default=0, help='Extra attributes per generated entity')
+    parser.add_argument('--storm-rate', type=float, default=0, help='Random state changes per second')
+    parser.add_argument('--storm-entities', help='Comma-separated entity IDs to toggle instead of random ones')
+    parser.add_argument('--service-latency', type=float, default=0, help='Seconds before reporting states changed by service calls')
+    parser.add_argument('--drop-rate', type=float, default=0, help='Share of service calls that never change the state (0-1)')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    fake_ha = FakeHomeAssistant(token=args.token, service_latency=args.service_latency, drop_rate=args.drop_rate, seed=args.seed)
+    if args.states:
+        with open(args.states, 'r', encoding='utf-8') as fp:
+            fake_ha.load_states(json.load(fp))
+    fake_ha.populate(args.entities, extra_attributes=args.attributes)
+
+    print(f'Fake Home Assistant on ws://{args.host}:{args.port} with {len(fake_ha.states)} entities')
+    tasks = [fake_ha.serve(args.host, args.port), fake_ha.print_stats()]
+    if args.storm_rate > 0:
+        storm_entities = args.storm_entities.split(',') if args.storm_entities else None
+        tasks.append(fake_ha.storm(args.storm_rate, entity_ids=storm_entities))
+
+    await asyncio.gather(*tasks)
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -1,13 +1,32 @@
 import asyncio
-import json
 import logging
 import traceback
 from contextlib import asynccontextmanager
+from typing import Dict, Iterable, Union
 
 import websockets
 
+from . import codec
+from .states import EntityState, StateStore
+
 logging.basicConfig(level=logging.INFO)
 
+# Maximum number of seconds to wait for the states of newly subscribed entities
+ENTITIES_SNAPSHOT_TIMEOUT = 10
+# Maximum number of seconds to wait for the result of a request
+REQUEST_TIMEOUT = 10
+
+# Subscribe to every entity, when the used ones can't all be found
+ALL_ENTITIES = ('*',)
+
+
+class HomeAssistantError(Exception):
+    ''' A request failed, timed out, or the connection was closed before its result '''
+
+    def __init__(self, message: str, code: str = None):
+        super().__init__(message)
+        self.code = code
+
 
 class HomeAssistantWebSocket:
     def __init__(self, host: str, token: str):
@@ -20,25 +39,57 @@ class HomeAssistantWebSocket:
         self._lock = asyncio.Lock()
         self._should_reconnect = True
 
-        self._states = {}
-
-        self._callbacks = {}
-        self._error_callbacks = {}
+        self._states = StateStore()
+        # Entity ID -> last state received from Home Assistant, while `_states` shows a predicted one
+        self._confirmed_states: Dict[str, EntityState] = {}
+        # Entity ID -> predicted state changes not reported yet, one per service call
+        self._pending_predictions: Dict[str, int] = {}
+
+        # Message ID -> future of its result
+        self._pending: Dict[int, asyncio.Future] = {}
+        # Subscription's message ID -> event handler
+        self._subscriptions = {}
+        self._reader_task = None
+
+        # Entities used by the configuration, and the ones subscribed with the current connection
+        self._entity_ids = None
+        self._entities_subscription_id = None
+        self._subscribed_entity_ids = None
+        self._entities_snapshot = None
+        self._subscribe_lock = asyncio.Lock()
       except: print("HomeAssistantWebSocket constructor error:"); traceback.print_exc()
 
     @asynccontextmanager
     async def connect(self) -> websockets.WebSocketClientProtocol:
-      try:
+        ''' Can be called again after disconnecting, states and listeners are kept '''
         ws_url = f'{self._host}/api/websocket'
 
         async with websockets.connect(ws_url, ping_timeout=5) as ws:
             self._ws = ws
-            await self._authenticate()
-            yield ws
-      except: print("HomeAssistantWebSocket connect error:"); traceback.print_exc()
+            # Subscriptions belong to the previous connection
+            self._subscriptions = {}
+            self._entities_subscription_id = None
+            self._subscribed_entity_ids = None
+
+            try:
+                await self._authenticate()
+
+                # The only task reading from the socket
+                self._reader_task = asyncio.get_running_loop().create_task(self._read_messages())
+                yield ws
+            finally:
+                if self._reader_task:
+                    self._reader_task.cancel()
+                self._fail_pending('Disconnected')
+                self._ws = None
+
+    @property
+    def is_connected(self) -> bool:
+        return self._ws is not None
 
     async def disconnect(self):
-        await self._ws.close()
+        if self._ws:
+            await self._ws.close()
 
     async def get_entity_state(self, entity_id: str):
         if entity_id in self._states:
@@ -48,7 +99,7 @@ class HomeAssistantWebSocket:
 
     async def _on_state_changed(self, data):
         try:
-            self._states[data['entity_id']] = data['new_state']
+            self._set_state_dict(data['entity_id'], data['new_state'])
 
             if self._callback:
                 await self._callback()
@@ -56,47 +107,116 @@ class HomeAssistantWebSocket:
             print('_on_state_changed', e)
 
     @property
-    def all_states(self):
+    def all_states(self) -> StateStore:
         return self._states
 
+    def _set_state_dict(self, entity_id: str, state: Union[dict, None]):
+        ''' Stores a full state from Home Assistant, None when the entity was removed '''
+        self._forget_prediction(entity_id)
+        if state:
+            self._states.set_state(self._states.make_state(entity_id, state['state'], state.get('attributes', {})))
+        else:
+            self._states.pop(entity_id)
+
     async def _authenticate(self):
-        response = await self._ws.recv()
-        auth_message = json.dumps({
+        response = await self._ws.recv(decode=False)
+        auth_message = codec.dumps({
             'type': 'auth',
             'access_token': self._token,
         })
-        await self._ws.send(auth_message)
-        response = await self._ws.recv()
+        await self._ws.send(auth_message, text=True)
+        response = await self._ws.recv(decode=False)
 
-        data = json.loads(response)
+        data = codec.loads(response)
         if data.get('type') != 'auth_ok':
-            raise Exception('Authentication failed!')
+            raise HomeAssistantError('Authentication failed!', code='auth_invalid')
 
         logging.info('Authenticated successfully.')
 
-    async def send_message(self, message: dict, callback=None):
+    async def send_message(self, message: dict, *, subscription=None, timeout: float = REQUEST_TIMEOUT):
+        '''
+        Sends a request and waits for its result. Requests are pipelined, results are matched by ID.
+        Events of a subscription are passed to `subscription`, registered before the request is sent.
+        Raises HomeAssistantError.
+        '''
         logging.info('send_message: ' + str(message))
-        async with self._lock:
-            message['id'] = self._message_id
-            if callback:
-                self._callbacks[message['id']] = callback
-
-            self._message_id += 1
-            await self._ws.send(json.dumps(message))
+        if not self._ws:
+            raise HomeAssistantError('Not connected', code='disconnected')
 
-            return message['id']
+        future = asyncio.get_running_loop().create_future()
 
-    async def send_message_sync(self, message: dict):
-        logging.info('send_message (sync): ' + str(message))
         async with self._lock:
-            message['id'] = self._message_id
+            message_id = self._message_id
             self._message_id += 1
-            await self._ws.send(json.dumps(message))
 
+            message['id'] = message_id
+            self._pending[message_id] = future
+            if subscription:
+                self._subscriptions[message_id] = subscription
+
+            try:
+                await self._ws.send(codec.dumps(message), text=True)
+            except Exception as e:
+                self._pending.pop(message_id, None)
+                self._subscriptions.pop(message_id, None)
+                raise HomeAssistantError(f'Could not send message: {e}') from e
+
+        try:
+            return await asyncio.wait_for(future, timeout=timeout)
+        except asyncio.TimeoutError:
+            self._subscriptions.pop(message_id, None)
+            raise HomeAssistantError(f'Request {message_id} timed out', code='timeout')
+        finally:
+            self._pending.pop(message_id, None)
+
+    def _fail_pending(self, reason: str):
+        pending = self._pending
+        self._pending = {}
+
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(HomeAssistantError(reason, code='disconnected'))
+
+    async def _read_messages(self):
+        try:
             while True:
-                data = json.loads(await self._ws.recv())
-                if data['type'] == 'result':
-                    return data['result']
+                try:
+                    # Text frames as UTF-8 bytes, they are only decoded by the JSON parser
+                    message = await self._ws.recv(decode=False)
+                except websockets.exceptions.ConnectionClosedOK:
+                    break
+
+                # Skip results and events nobody is waiting for (timed out requests, old subscriptions...)
+                message_id, message_type = codec.peek_message(message)
+                if message_type == 'result' and message_id not in self._pending:
+                    continue
+                if message_type == 'event' and message_id not in self._subscriptions:
+                    continue
+
+                data = codec.loads(message)
+                message_type = data.get('type')
+
+                if message_type == 'result':
+                    future = self._pending.get(data.get('id'))
+                    if not future or future.done():
+                        continue
+
+                    if data.get('success', True):
+                        future.set_result(data.get('result'))
+                    else:
+                        error = data.get('error') or {}
+                        self._subscriptions.pop(data['id'], None)
+                        future.set_exception(HomeAssistantError(error.get('message', 'Unknown error'), code=error.get('code')))
+                elif message_type == 'event':
+                    handler = self._subscriptions.get(data.get('id'))
+                    if handler:
+                        # Handlers must not wait for results, they are read by this task
+                        try:
+                            await handler(data['event'])
+                        except Exception:
+                            traceback.print_exc()
+        finally:
+            self._fail_pending('Connection closed')
 
     async def call_service(self, *, domain: str, service: str, service_data: dict = None):
         return await self.send_message({
@@ -112,49 +232,204 @@ class HomeAssistantWebSocket:
             'entity_id': entity_id
         })
 
-    async def get_all_states(self, callback=None):
-        states = await self.send_message_sync({'type': 'get_states'})
+    async def get_all_states(self):
+        states = await self.send_message({'type': 'get_states'})
         logging.info('Received all_states')
-        self._states = {state['entity_id']: state for state in states}
+        self._states.retain(state['entity_id'] for state in states)
+        for state in states:
+            self._set_state_dict(state['entity_id'], state)
 
     async def turn_on(self, entity_id: str):
-        return await self.call_service('homeassistant', 'turn_on', {
+        return await self.call_service(domain='homeassistant', service='turn_on', service_data={
             'entity_id': entity_id,
         })
 
     async def turn_off(self, entity_id: str):
-        return await self.call_service('homeassistant', 'turn_off', {
+        return await self.call_service(domain='homeassistant', service='turn_off', service_data={
             'entity_id': entity_id,
         })
 
     async def subscribe_events(self, event_type: str):
-        return await self.send_message({
+        ''' Events are dispatched to listeners added with `on_event()` '''
+        async def on_event(event: dict):
+            if event_type == 'state_changed':
+                self._set_state_dict(event['data']['entity_id'], event['data']['new_state'])
+
+            for callback in self._event_listeners.get(event_type, []):
+                await callback(event['data'])
+
+        await self.send_message({
             'type': 'subscribe_events',
             'event_type': event_type,
-        })
+        }, subscription=on_event)
+
+    async def subscribe_entities(self, entity_ids: Union[Iterable[str], None], attributes: Union[Iterable[str], None] = None):
+        '''
+        Receive compressed state changes of `entity_ids` only (None for all of them), they are applied to `all_states`
+        and dispatched to "state_changed" listeners.
+        States of other entities are removed, and only `attributes` are kept (None for all of them).
+        Returns once the current states are received.
+        When disconnected, they are subscribed by `resubscribe()` after reconnecting.
+        '''
+        async with self._subscribe_lock:
+            entity_ids = ALL_ENTITIES if entity_ids is None else sorted(entity_ids)
+            self._entity_ids = entity_ids
+
+            # Attributes dropped before are only received again with a new snapshot
+            if self._states.keep_attributes(attributes):
+                self._subscribed_entity_ids = None
+
+            if not self.is_connected or entity_ids == self._subscribed_entity_ids:
+                return
+
+            # Replace the old subscription
+            if self._entities_subscription_id:
+                self._subscriptions.pop(self._entities_subscription_id, None)
+                await self.send_message({
+                    'type': 'unsubscribe_events',
+                    'subscription': self._entities_subscription_id,
+                })
+                self._entities_subscription_id = None
+
+            self._subscribed_entity_ids = entity_ids
+
+            message = {'type': 'subscribe_entities'}
+            if entity_ids is not ALL_ENTITIES:
+                # Update in place, the store is shared with the configuration
+                self._states.retain(entity_ids)
+                for entity_id in set(self._confirmed_states) - set(entity_ids):
+                    self._forget_prediction(entity_id)
+
+                # Nothing to subscribe to
+                if not entity_ids:
+                    return
+
+                message['entity_ids'] = entity_ids
+
+            # The first event contains current states
+            self._entities_snapshot = asyncio.get_running_loop().create_future()
+            await self.send_message(message, subscription=self._on_entities_event)
+            self._entities_subscription_id = message['id']
+
+            try:
+                await asyncio.wait_for(self._entities_snapshot, timeout=ENTITIES_SNAPSHOT_TIMEOUT)
+            except asyncio.TimeoutError:
+                logging.info('Timed out waiting for the states of subscribed entities')
+
+    async def resubscribe(self):
+        ''' Subscribe again after reconnecting, changes since the last known states are dispatched '''
+        if self._entity_ids is not None:
+            await self.subscribe_entities(None if self._entity_ids is ALL_ENTITIES else self._entity_ids, self._states.attribute_names)
+
+    async def _on_entities_event(self, event: dict):
+        changes = []
+
+        # First event of a subscription: entities missing from it were removed while disconnected
+        if self._entities_snapshot and not self._entities_snapshot.done():
+            added = event.get('a', {})
+            subscribed_entity_ids = list(self._states) if self._subscribed_entity_ids is ALL_ENTITIES else self._subscribed_entity_ids or []
+            for entity_id in subscribed_entity_ids:
+                if entity_id not in added and entity_id in self._states:
+                    self._forget_prediction(entity_id)
+                    changes.append((entity_id, self._states.pop(entity_id), None))
+
+        # Added: full states
+        for entity_id, compressed_state in event.get('a', {}).items():
+            old_state = self._states.get(entity_id)
+            new_state = self._reconcile(entity_id, self._states.make_state(entity_id, compressed_state['s'], compressed_state.get('a', {})))
+            self._states.set_state(new_state)
+
+            if old_state != new_state:
+                changes.append((entity_id, old_state, new_state))
+
+        # Changed: diffs
+        for entity_id, diff in event.get('c', {}).items():
+            old_state = self._states.get(entity_id)
+            if not old_state:
+                continue
+
+            # Diffs are relative to Home Assistant's state, not the predicted one
+            new_state = self._apply_state_diff(self._confirmed_states.get(entity_id, old_state), diff)
+            new_state = self._reconcile(entity_id, new_state)
+            self._states.set_state(new_state)
+            changes.append((entity_id, old_state, new_state))
+
+        # Removed
+        for entity_id in event.get('r', []):
+            old_state = self._states.pop(entity_id, None)
+            self._forget_prediction(entity_id)
+            if old_state:
+                changes.append((entity_id, old_state, None))
+
+        if self._entities_snapshot and not self._entities_snapshot.done():
+            self._entities_snapshot.set_result(True)
+
+        for entity_id, old_state, new_state in changes:
+            for callback in self._event_listeners.get('state_changed', []):
+                await callback({
+                    'entity_id': entity_id,
+                    'old_state': old_state,
+                    'new_state': new_state,
+                })
+
+    def predict_state(self, entity_id: str, state: str) -> bool:
+        '''
+        Shows `state` in `all_states` before Home Assistant reports it.
+        It's kept until Home Assistant reported as many state changes as there were predictions,
+        or `discard_prediction()` is called.
+        '''
+        current_state = self._states.get(entity_id)
+        if not current_state:
+            return False
+
+        self._confirmed_states.setdefault(entity_id, current_state)
+        self._pending_predictions[entity_id] = self._pending_predictions.get(entity_id, 0) + 1
+        self._states.set_state(current_state.with_state(state))
+        return True
+
+    def discard_prediction(self, entity_id: str) -> bool:
+        ''' Goes back to Home Assistant's state, returns True when it was predicted '''
+        confirmed_state = self._forget_prediction(entity_id)
+        if not confirmed_state:
+            return False
 
-    async def listen(self):
-        async for message in self._ws:
-            data = json.loads(message)
-            # logging.info(f'Received: {message}')
+        if entity_id in self._states:
+            self._states.set_state(confirmed_state)
+        return True
 
-            if 'id' in data and data['id'] in self._callbacks:
-                if 'result' not in data:
-                    continue
+    def _reconcile(self, entity_id: str, new_state: EntityState) -> EntityState:
+        ''' Returns the state to show after receiving `new_state` '''
+        confirmed_state = self._confirmed_states.get(entity_id)
+        if not confirmed_state:
+            return new_state
+
+        predicted = self._states[entity_id]['state']
+        if new_state['state'] != confirmed_state['state']:
+            self._pending_predictions[entity_id] -= 1
+
+        if self._pending_predictions[entity_id] > 0:
+            # Not applied yet (e.g. only attributes changed), or the result of an earlier call
+            self._confirmed_states[entity_id] = new_state
+            return new_state.with_state(predicted)
+
+        # Result of the last call, or changed by something else
+        self._forget_prediction(entity_id)
+        return new_state
 
-                callback = self._callbacks.pop(data['id'])
-                if callback:
-                    await callback(data['result'])
-            elif data.get('type') == 'event' and data.get('event', {}).get('event_type') in self._event_listeners:
-                event = data['event']
-                event_type = event['event_type']
-                event_data = event['data']
-                # Update state
-                if event_type == 'state_changed':
-                    self._states[event_data['entity_id']] = event_data['new_state']
-
-                for callback in self._event_listeners[event_type]:
-                    await callback(event_data)
+    def _forget_prediction(self, entity_id: str) -> Union[EntityState, None]:
+        ''' Returns the last state received from Home Assistant when `entity_id` was predicted '''
+        self._pending_predictions.pop(entity_id, None)
+        return self._confirmed_states.pop(entity_id, None)
+
+    def _apply_state_diff(self, old_state: EntityState, diff: dict) -> EntityState:
+        to_add = diff.get('+', {})
+        to_remove = diff.get('-', {})
+
+        return self._states.apply_diff(old_state, state=to_add.get('s'), attributes=to_add.get('a'), removed_attributes=to_remove.get('a', []))
+
+    async def listen(self):
+        ''' Returns when the connection is closed '''
+        await self._reader_task
 
     def on_event(self, event_type: str, callback):
         if event_type not in self._event_listeners:
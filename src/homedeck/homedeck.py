@@ -2,61 +2,85 @@ from __future__ import annotations
 
 import asyncio
 import copy
+import hashlib
 import os
+import random
 import sys
 import time
 import traceback
 from dataclasses import asdict
+from typing import Union
 
+import websockets
 import yaml
 from dotenv import load_dotenv
 from strmdck.device import ButtonAction
-from strmdck.device_manager import auto_connect
 from watchdog.events import FileSystemEventHandler
 from watchdog.observers import Observer
 
+from .actions import ActionQueue
+from .animations import AnimationScheduler
+from .build import BUILD_DIR, build_directory
 from .configuration import Configuration
+from .devices import auto_connect
 from .elements import InteractionType, PageElement
 from .enums import SleepStatus
 from .event_bus import EventName, event_bus
-from .home_assistant import HomeAssistantWebSocket
+from .home_assistant import HomeAssistantError, HomeAssistantWebSocket
+from .icons import CACHE_GENERATED_DIR, icon_provider
+from .optimistic import OptimisticStates
+from .pictures import PICTURE_CACHE_DIR, picture_provider
+from .storage import STORAGE_RAM_MAX_SIZE, storage
 from .utils import deep_merge
+from .virtual_device import VIRTUAL_DEVICE, VirtualDeckDevice
 
 load_dotenv()
 HA_HOST = os.getenv('HA_HOST')
 HA_ACCESS_TOKEN = os.getenv('HA_ACCESS_TOKEN')
 
+CONFIGURATION_PATH = os.path.join('assets', 'configuration.yml')
+# Wait for the last event of a burst (editors write files in multiple steps)
+CONFIGURATION_RELOAD_DELAY = 0.1
+# Seconds without button presses before caches are written to disk
+STORAGE_IDLE_DELAY = 5
+DEVICE_RECONNECT_DELAY = 3
+# Delay before reconnecting to Home Assistant, doubled after each failed attempt
+HA_RECONNECT_MIN_DELAY = 1
+HA_RECONNECT_MAX_DELAY = 60
+
 
 class HomeDeck:
     class ConfigurationFileChangeHandler(FileSystemEventHandler):
-        def __init__(self, deck: HomeDeck):
+        EVENT_TYPES = {'created', 'modified', 'moved', 'deleted', 'closed'}
+
+        def __init__(self, deck: HomeDeck, loop: asyncio.AbstractEventLoop):
             self._deck = deck
-            self._file_path = os.path.abspath('assets/configuration.yml')
-            self._last_modified = 0
-
-        def on_modified(self, event):
-            if event.src_path == self._file_path:
-                # Ignore events within 1 seconds
-                now = time.time()
-                if now - self._last_modified >= 1:
-                    self._last_modified = now
-                    self._deck._need_reload_all = True
-
-        '''
-        def on_created(self, event):
-            if event.src_path == self._file_path:
-                self._device.reload_all()
-
-        def on_deleted(self, event):
-            if event.src_path == self._file_path:
-                raise ValueError('configuration.yml file deleted')
-        '''
+            self._loop = loop
+            self._file_path = os.path.abspath(CONFIGURATION_PATH)
+
+        def on_any_event(self, event):
+            if event.event_type not in self.EVENT_TYPES:
+                return
+
+            # Editors often save by writing a temp file and renaming it over the original
+            paths = [event.src_path, getattr(event, 'dest_path', '')]
+            if not any(path and os.path.abspath(path) == self._file_path for path in paths):
+                return
+
+            # Called from watchdog's thread
+            self._loop.call_soon_threadsafe(self._deck._on_configuration_file_changed)
 
     def __init__(self, vendor_id: int = 0x2207, product_id: int = 0x0019):
         self._vendor_id = vendor_id
         self._product_id = product_id
 
         self._configuration_observer = None
+        self._configuration_hash = None
+        self._configuration_reload_timer = None
+        self._configuration_reload_task = None
+        self._ha = None
+        self._animations = None
+        self._is_reload_scheduled = False
         script_dir = os.path.dirname(os.path.realpath(__file__))
         with open(os.path.join(script_dir, 'yaml', 'configuration.base.yml'), 'r') as fp:
             self._base_configuration_dict = yaml.safe_load(fp.read())
@@ -64,18 +88,35 @@ class HomeDeck:
     async def connect(self, retries: int = -1):
         await self._setup()
 
-    def reload_all(self) -> bool:
+    def _read_configuration_file(self) -> Union[bytes, None]:
+        try:
+            with open(CONFIGURATION_PATH, 'rb') as fp:
+                return fp.read()
+        except FileNotFoundError:
+            return None
+
+    async def reload_all(self, content: bytes = None) -> bool:
         if not self._ha:
             return False
 
-        self._need_reload_all = False
-
         try:
-            with open(os.path.join('assets', 'configuration.yml'), 'r', encoding='utf-8') as fp:
-                configuration_dict = yaml.safe_load(fp.read())
-                configuration_dict = deep_merge(copy.deepcopy(self._base_configuration_dict), configuration_dict)
+            if content is None:
+                content = self._read_configuration_file()
 
-                new_configuration = Configuration(device=self._device, source_dict=configuration_dict, all_states=self._ha.all_states)
+            if not content or not content.strip():
+                print('⚠️ configuration.yml is missing or empty')
+                # Nothing to show on startup
+                if not self._configuration:
+                    sys.exit(1)
+
+                return False
+
+            self._configuration_hash = hashlib.sha1(content).hexdigest()
+
+            configuration_dict = yaml.safe_load(content.decode('utf-8'))
+            configuration_dict = deep_merge(copy.deepcopy(self._base_configuration_dict), configuration_dict)
+
+            new_configuration = Configuration(device=self._device, source_dict=configuration_dict, all_states=self._ha.all_states)
 
             if not new_configuration or not new_configuration.is_valid():
                 # Crash app if the configuration file is invalid on startup
@@ -84,6 +125,10 @@ class HomeDeck:
 
                 return
 
+            # Only keep and receive states of entities used by the configuration.
+            # Pages are set up later, with these states
+            await self._ha.subscribe_entities(new_configuration.referenced_entities, new_configuration.referenced_attributes)
+
             # Check configuration changed
             print('✅ Configuration changed!')
             self._configuration = new_configuration
@@ -100,11 +145,12 @@ class HomeDeck:
         self.page_go_to('$root', 1, append_stack=True)
         return True
 
-    async def call_ha_service(self, *, domain: str, service: str, service_data: dict):
-        try:
-            await self._ha.call_service(domain=domain, service=service, service_data=service_data)
-        except Exception:
-            pass
+    def call_ha_service(self, *, domain: str, service: str, service_data: dict):
+        if self._configuration and self._configuration.optimistic:
+            self._optimistic_states.predict(domain=domain, service=service, service_data=service_data)
+
+        # Don't wait for the result, button presses are read in the same task
+        self._action_queue.submit(domain=domain, service=service, service_data=service_data)
 
     def reload_current_page(self, *, force=False) -> bool:
         return self.reload_page(self._current_page_id, force=force)
@@ -128,14 +174,47 @@ class HomeDeck:
             # Update full page
             buttons = PageElement.generate(page.buttons)
             self._device.set_buttons(buttons)
+            self._animations.set_buttons(buttons)
         else:
             # Only update changed buttons
             buttons = PageElement.generate(page.changed_buttons)
             self._device.set_buttons(buttons, update_only=True)
+            self._animations.set_buttons(buttons, update_only=True)
 
         self._current_page_element = page
+
+        # Render other states of buttons once the deck is updated
+        self._schedule_state_variants(page)
         return True
 
+    def _icons_in_use(self) -> set:
+        ''' Generated icons shown on the deck, they must not be evicted '''
+        in_use = build_directory.live_icons
+        if self._animations:
+            in_use |= self._animations.filenames
+
+        return in_use
+
+    def _schedule_state_variants(self, page: PageElement):
+        # Variants only change with the configuration or the page, not with states
+        if page is self._state_variants_page:
+            return
+
+        self._state_variants_page = page
+        if self._state_variants_task:
+            self._state_variants_task.cancel()
+
+        self._state_variants_task = asyncio.get_running_loop().create_task(self._render_state_variants(page))
+
+    async def _render_state_variants(self, page: PageElement):
+        for button_config in page.state_variants(all_states=self._ha.all_states):
+            # Let button presses and state changes in between
+            await asyncio.sleep(0)
+            try:
+                icon_provider.get_icon(button_config)
+            except Exception:
+                traceback.print_exc()
+
     async def _read_packets(self):
         button_index = None
         button_state = None
@@ -221,6 +300,11 @@ class HomeDeck:
             # Keep alive
             self._device.keep_alive()
 
+            # Write caches to disk while the deck isn't being used
+            if time.time() - self._last_action_time > STORAGE_IDLE_DELAY and storage.maintain():
+                # Some generated icons were removed from RAM
+                self.force_reload_current_page()
+
             # Update sleep status
             if self._sleep_status == SleepStatus.SLEEP or self._last_action_time <= 0:
                 continue
@@ -235,6 +319,7 @@ class HomeDeck:
             elif sleep_config.dim_timeout > 0 and self._sleep_status != SleepStatus.DIM and diff > sleep_config.dim_timeout:
                 # Dim device
                 self._sleep_status = SleepStatus.DIM
+                self._animations.pause()
                 self._device.set_brightness(sleep_config.dim_brightness)
 
     def _wake_up(self):
@@ -244,12 +329,18 @@ class HomeDeck:
         # Sleep device
         self._sleep_status = SleepStatus.WAKE
         self._last_action_time = time.time()
+        self._animations.resume()
 
     def _sleep(self):
         # Sleep device
         self._device.set_brightness(0)
         self._sleep_status = SleepStatus.SLEEP
         self._last_action_time = time.time()
+        self._animations.pause()
+
+    def _on_animation_frame(self, buttons: dict):
+        if self._is_ready and self._sleep_status == SleepStatus.WAKE:
+            self._device.set_buttons(buttons, update_only=True)
 
     async def _on_interacted(self, interaction: InteractionType, index: int, state: object):
         print('👆', interaction.value, index, state)
@@ -274,16 +365,19 @@ class HomeDeck:
     def _reset(self):
         self._is_ready = False
 
+        # It would be applied to the next device
+        if self._configuration_reload_task:
+            self._configuration_reload_task.cancel()
+
         if hasattr(self, '_device') and self._device:
             self._device.close()
         self._device = None
 
-        self._ha = HomeAssistantWebSocket(HA_HOST, HA_ACCESS_TOKEN)
-
         self._current_page_element = None
+        self._state_variants_task = None
+        self._state_variants_page = None
         self._pages_stack = []
 
-        self._need_reload_all = True
         self._configuration = None
 
         self._sleep_status = SleepStatus.WAKE
@@ -294,7 +388,22 @@ class HomeDeck:
         event_bus.subscribe(EventName.DECK_RELOAD, self.reload_current_page)
         event_bus.subscribe(EventName.DECK_FORCE_RELOAD, self.force_reload_current_page)
 
-        reconnect_delay = 3
+        # Generated files are emptied on every start and kept in RAM
+        storage.hot_dir(CACHE_GENERATED_DIR, max_size=STORAGE_RAM_MAX_SIZE, on_evicted=icon_provider.clear_cache, in_use=self._icons_in_use)
+        storage.hot_dir(PICTURE_CACHE_DIR)
+        storage.hot_dir(BUILD_DIR)
+
+        picture_provider.setup(HA_HOST, HA_ACCESS_TOKEN)
+        self._animations = AnimationScheduler(self._on_animation_frame)
+
+        # Home Assistant's connection doesn't depend on the device's
+        self._ha = HomeAssistantWebSocket(HA_HOST, HA_ACCESS_TOKEN)
+        self._ha.on_event('state_changed', self._ha_on_state_changed)
+        self._ha_connected = asyncio.Event()
+        self._optimistic_states = OptimisticStates(self._ha, self._schedule_reload)
+        self._action_queue = ActionQueue(self._ha.call_service, on_failed=lambda call: self._optimistic_states.rollback(call.service_data))
+        self._ha_task = asyncio.get_running_loop().create_task(self._run_home_assistant())
+
         while True:
             self._reset()
 
@@ -303,14 +412,15 @@ class HomeDeck:
                 device = None
                 while True:
                     try:
-                        device = auto_connect()
+                        device = VirtualDeckDevice.from_env() if VIRTUAL_DEVICE else auto_connect()
                         if device:
+                            build_directory.reset()
                             self._device = device
                             print('Device connected')
                             break
 
                         print('Could not find any device')
-                        await asyncio.sleep(reconnect_delay)
+                        await asyncio.sleep(DEVICE_RECONNECT_DELAY)
                     except Exception as e:
                         try:
                             device.close()
@@ -318,21 +428,18 @@ class HomeDeck:
                             pass
 
                         print('Could not open the device:', e)
-                        await asyncio.sleep(reconnect_delay)
-
-                # Setup Home Assistant
-                async with self._ha.connect():
-                    await self._ha.get_all_states()
-                    self._ha.on_event('state_changed', self._ha_on_state_changed)
-                    await self._ha.subscribe_events('state_changed')
-
-                    self._is_ready = True
-                    await asyncio.gather(
-                        self._ha.listen(),
-                        self._read_packets(),
-                        self._keep_alive(),
-                        self._setup_hot_reload(),
-                    )
+                        await asyncio.sleep(DEVICE_RECONNECT_DELAY)
+
+                # States are needed to set up pages, only wait for them on startup
+                await self._ha_connected.wait()
+
+                self._is_ready = True
+                await HomeDeck._run_until_failed(
+                    self._read_packets(),
+                    self._keep_alive(),
+                    self._setup_hot_reload(),
+                    self._animations.run(),
+                )
             except Exception:
                 traceback.print_exc()
 
@@ -347,34 +454,117 @@ class HomeDeck:
                 except Exception:
                     pass
 
-                try:
-                    await self._ha.disconnect()
-                except Exception:
-                    pass
+                await asyncio.sleep(DEVICE_RECONNECT_DELAY)
+
+    @staticmethod
+    async def _run_until_failed(*coroutines):
+        ''' Like asyncio.gather(), but other tasks are cancelled when one fails '''
+        tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _run_home_assistant(self):
+        delay = HA_RECONNECT_MIN_DELAY
+        while True:
+            try:
+                async with self._ha.connect():
+                    print('Home Assistant connected')
+                    delay = HA_RECONNECT_MIN_DELAY
+
+                    # Get states changed while disconnected, changed buttons are re-rendered.
+                    # The deck keeps showing the last known states in the meantime
+                    await self._ha.resubscribe()
+                    self._ha_connected.set()
+
+                    await self._ha.listen()
+            except HomeAssistantError as e:
+                print('Home Assistant:', e)
+                if e.code == 'auth_invalid':
+                    sys.exit(1)
+            except (OSError, websockets.exceptions.WebSocketException) as e:
+                print('Home Assistant connection error:', e)
+            except Exception:
+                traceback.print_exc()
+
+            # Don't replay old button presses after reconnecting
+            self._action_queue.cancel()
 
-                await asyncio.sleep(reconnect_delay)
+            # Jittered exponential backoff
+            wait_time = delay * random.uniform(0.5, 1)
+            print(f'Reconnecting to Home Assistant in {wait_time:.1f}s')
+            await asyncio.sleep(wait_time)
+            delay = min(delay * 2, HA_RECONNECT_MAX_DELAY)
 
     async def _ha_on_state_changed(self, _):
+        self._schedule_reload()
+
+    def _schedule_reload(self):
+        # Configuration is still loading
+        if not self._configuration:
+            return
+
         # Only reload page when it's not sleeping
-        if self._sleep_status != SleepStatus.SLEEP:
+        if self._sleep_status == SleepStatus.SLEEP:
+            return
+
+        # Render once for all changes of a message (e.g. after reconnecting)
+        if not self._is_reload_scheduled:
+            self._is_reload_scheduled = True
+            asyncio.get_running_loop().call_soon(self._reload_after_state_changes)
+
+    def _reload_after_state_changes(self):
+        self._is_reload_scheduled = False
+        if self._is_ready and self._configuration:
             self.reload_current_page()
 
     async def _setup_hot_reload(self):
         print('Setting up hot reload')
 
         if not self._configuration_observer:
-            event_handler = self.ConfigurationFileChangeHandler(self)
+            event_handler = self.ConfigurationFileChangeHandler(self, asyncio.get_running_loop())
             observer = Observer()
-            observer.schedule(event_handler, path='./assets', recursive=False)
+            observer.schedule(event_handler, path=os.path.dirname(CONFIGURATION_PATH), recursive=False)
 
             observer.start()
             self._configuration_observer = observer
 
-        while True:
-            if self._need_reload_all:
-                self.reload_all()
+        await self.reload_all()
 
-            await asyncio.sleep(1)
+    def _on_configuration_file_changed(self):
+        # Trailing-edge debounce: restart the timer on every event
+        if self._configuration_reload_timer:
+            self._configuration_reload_timer.cancel()
+
+        loop = asyncio.get_running_loop()
+        self._configuration_reload_timer = loop.call_later(CONFIGURATION_RELOAD_DELAY, self._check_configuration_file)
+
+    def _check_configuration_file(self):
+        self._configuration_reload_timer = None
+        if not self._is_ready:
+            return
+
+        content = self._read_configuration_file()
+        if content is None:
+            print('⚠️ configuration.yml was deleted, keeping the current configuration')
+            return
+
+        # Skip touch-only events
+        if hashlib.sha1(content).hexdigest() == self._configuration_hash:
+            return
+
+        # The newest content wins
+        if self._configuration_reload_task:
+            self._configuration_reload_task.cancel()
+
+        self._configuration_reload_task = asyncio.get_running_loop().create_task(self.reload_all(content))
+        self._configuration_reload_task.add_done_callback(self._on_configuration_reloaded)
+
+    def _on_configuration_reloaded(self, task: asyncio.Task):
+        if task is self._configuration_reload_task:
+            self._configuration_reload_task = None
 
     def page_go_to(self, page_id: str, page_number: int = 1, append_stack=True):
         if not self._configuration.has_page(page_id):
@@ -1,19 +1,25 @@
 import asyncio
+import hashlib
+import io
 import logging
+import math
 import os
-import shutil
+import time
 from abc import ABC, abstractmethod
-from dataclasses import fields
 from typing import Dict, List, Tuple, Union
 
 import cairosvg
 import httpx
-from PIL import Image, ImageDraw, ImageEnhance, ImageFont
+from PIL import Image, ImageChops, ImageDraw, ImageEnhance, ImageFont
 
-from .dataclasses import ICON_FIELDS, TEXT_ICON_FIELDS, PageButtonConfig
+from .dataclasses import FrozenPageButtonConfig
 from .enums import IconSource, MaterialYouScheme, PhosphorIconVariant
 from .event_bus import EventName, event_bus
+from .pictures import PictureProvider
+from .url_cache import url_cache
 from .utils import (
+    LRUCache,
+    freeze,
     generate_material_you_palette,
     hex_to_rgb,
     normalize_hex_color,
@@ -26,9 +32,25 @@ logging.basicConfig(level=logging.INFO)
 ENV_ENABLE_CACHE = int(os.getenv('ENABLE_CACHE', 1)) != 0
 CACHE_ICONS_DIR = os.path.join('.cache', 'icons')
 CACHE_GENERATED_DIR = os.path.join(CACHE_ICONS_DIR, '_generated')
-# Remove _generated directory when the script starts
-if os.path.exists(CACHE_GENERATED_DIR):
-    shutil.rmtree(CACHE_GENERATED_DIR)
+FONTS_DIR = os.path.join('assets', 'fonts')
+# Failed downloads are retried after this delay, doubled after each failure
+ICON_RETRY_MIN_DELAY = 5
+ICON_RETRY_MAX_DELAY = 5 * 60
+
+# Animations
+ANIMATION_SPIN = 'spin'
+ANIMATION_BLINK = 'blink'
+ANIMATIONS = (ANIMATION_SPIN, ANIMATION_BLINK)
+ANIMATION_FRAME_DURATION = 125
+ANIMATION_SPIN_FRAMES = 8
+ANIMATION_MAX_FRAMES = 30
+
+# `text_size: auto` = the largest size that fits the button
+TEXT_SIZE_AUTO = 'auto'
+MIN_TEXT_SIZE = 8
+# Multi-line texts, same as ImageDraw's defaults
+TEXT_LINE_SPACING = 4
+TEXT_LINE_ALIGN = 'left'
 
 
 class Icon:
@@ -39,6 +61,8 @@ class Icon:
         layers = sorted(layers, key=lambda val: (val.get('z_index', 0)), reverse=False)
 
         self._icon_layers: List[IconLayer] = []
+        # Time when cached URL images should be revalidated
+        self._expires_at = math.inf
         for layer in layers:
             if not layer:
                 continue
@@ -70,23 +94,42 @@ class Icon:
                 file_path = layer['icon_name']
                 layer['icon_name'] = os.path.basename(file_path)
                 icon = LocalIconLayer(layer, file_path=file_path)
+            elif icon_source == IconSource.PICTURE:
+                icon = PictureIconLayer(layer)
 
             if not icon:
                 continue
 
             if isinstance(icon, RemoteIconLayer) and icon.is_available():
+                if isinstance(icon, UrlIconLayer):
+                    url = icon.download_url
+                    url_cache.touch(url)
+                    self._expires_at = min(self._expires_at, url_cache.expires_at(url))
+
+                    # Revalidate in the background, use the cached image in the meantime
+                    if url_cache.is_stale(url):
+                        icon_provider._request_icon(icon)
+
                 icon = LocalIconLayer(layer, icon.original_file_path)
 
             self._icon_layers.append(icon)
 
+        # Some layers are still being downloaded
+        self._is_complete = not any(isinstance(icon, RemoteIconLayer) for icon in self._icon_layers)
+
+        # Stable across runs, unlike hash() of strings
+        self._generated_filename = hashlib.sha1('-'.join(icon.digest for icon in self._icon_layers).encode('utf-8')).hexdigest() + '.png'
+
         os.makedirs(CACHE_GENERATED_DIR, exist_ok=True)
-        self._generated_path = os.path.join(CACHE_GENERATED_DIR, self.generated_filename())
+        self._generated_path = os.path.join(CACHE_GENERATED_DIR, self._generated_filename)
 
-        if not os.path.exists(self._generated_path):
+        is_cached = os.path.exists(self._generated_path)
+        if not is_cached:
+            # Compose layers in memory, only the final image is written to disk
             for icon in self._icon_layers:
                 layer_img = icon.get_image()
                 if layer_img:
-                    icon_img.paste(layer_img, (0, 0), layer_img)
+                    icon_img.alpha_composite(layer_img)
 
             # Save image
             icon_img.save(self._generated_path, 'PNG')
@@ -94,6 +137,50 @@ class Icon:
             # Optimize image
             optimize_image(self._generated_path, optimize_level=5)
 
+        # Frames of animated icons
+        self._frames = self._compose_frames(max_width, max_height)
+
+        # Reused, keep it away from eviction
+        if is_cached:
+            self.touch()
+
+    def _compose_frames(self, max_width: int, max_height: int) -> List[Tuple[str, int]]:
+        layer_frames = {}
+        for icon in self._icon_layers:
+            frames = icon.get_frames()
+            if frames:
+                layer_frames[icon] = frames
+
+        if not layer_frames:
+            return []
+
+        # Use the timing of the longest animation, shorter ones are looped
+        main_frames = max(layer_frames.values(), key=len)
+        base_name = os.path.splitext(self._generated_filename)[0]
+
+        output = []
+        for index, (_, duration) in enumerate(main_frames):
+            filename = f'{base_name}-{index}.png'
+            file_path = os.path.join(CACHE_GENERATED_DIR, filename)
+            if not os.path.exists(file_path):
+                frame_img = Image.new('RGBA', (max_width, max_height), (0, 0, 0, 0))
+                for icon in self._icon_layers:
+                    if icon in layer_frames:
+                        frames = layer_frames[icon]
+                        layer_img = frames[index % len(frames)][0]
+                    else:
+                        layer_img = icon.get_image()
+
+                    if layer_img:
+                        frame_img.alpha_composite(layer_img)
+
+                # Frames are temporary, skip optimizing them
+                frame_img.save(file_path, 'PNG')
+
+            output.append((filename, duration))
+
+        return output
+
     def _normalize_icon(self, icon: dict, material_you_palette=None):
         icon['icon_source'] = IconSource.BLANK
         if icon.get('icon'):
@@ -162,14 +249,44 @@ class Icon:
             icon['icon_offset'] = normalize_tuple(icon['icon_offset'])
 
     def generated_filename(self):
-        return f'test-{hash(tuple(self._icon_layers))}.png'
+        return self._generated_filename
+
+    def touch(self):
+        ''' Mark the generated files as recently used, so they are the last to be evicted '''
+        for filename in [self._generated_filename] + [filename for filename, _ in self._frames]:
+            try:
+                os.utime(os.path.join(CACHE_GENERATED_DIR, filename))
+            except OSError:
+                pass
+
+    def is_complete(self) -> bool:
+        return self._is_complete
+
+    @property
+    def expires_at(self) -> float:
+        return self._expires_at
+
+    @property
+    def frames(self) -> List[Tuple[str, int]]:
+        ''' List of (filename, duration in ms) of animated icons '''
+        return self._frames
 
 
 class IconLayer(ABC):
+    MAX_CACHED_IMAGES = 256
+    MAX_CACHED_FRAMES = 16
+    MAX_STATIC_LAYERS = 4096
+
+    # Layer's ID -> rasterized RGBA image
+    _cached_images = LRUCache(MAX_CACHED_IMAGES)
+    # Layer's ID -> list of (RGBA image, duration), animated layers only
+    _cached_frames = LRUCache(MAX_CACHED_FRAMES)
+    # IDs of layers that are not animated, so they don't push animations out of `_cached_frames`
+    _static_layers = set()
+
     def __init__(self, icon: dict, file_path: str = None):
-        self._is_generated = False
         self._icon = icon
-        self._hash = None
+        self._digest = None
 
         # Set default name
         if not hasattr(self, '_name'):
@@ -179,9 +296,6 @@ class IconLayer(ABC):
         if file_path:
             os.makedirs(os.path.dirname(file_path), exist_ok=True)
 
-        os.makedirs(CACHE_GENERATED_DIR, exist_ok=True)
-        self._generated_path = os.path.join(CACHE_GENERATED_DIR, self.generated_filename())
-
     def is_available(self) -> bool:
         # Blank icon
         if self._original_file_path is None:
@@ -189,17 +303,22 @@ class IconLayer(ABC):
 
         return os.path.exists(self._original_file_path)
 
-    def __hash__(self):
-        if not self._hash:
+    @property
+    def digest(self) -> str:
+        if not self._digest:
             icon_fields = list(self._icon.keys())
             sorted_fields = {key: self._icon[key] for key in icon_fields}
             joined = '-'.join([f'{key}{str(value).upper()}' for key, value in sorted_fields.items()])
-            self._hash = hash('-'.join([self._icon['icon_source'].value, self._name, joined]))
+            self._digest = hashlib.sha1('-'.join([self._icon['icon_source'].value, self._name, joined]).encode('utf-8')).hexdigest()
 
-        return self._hash * (1 if self.is_available() else -1)
+        # Changes once the file is downloaded
+        return self._digest if self.is_available() else f'{self._digest}-missing'
+
+    def __hash__(self):
+        return hash(self.digest)
 
     def generated_filename(self) -> str:
-        return f'{self._icon["icon_source"].value}-{self._name}-{self.__hash__()}.png'
+        return f'{self._icon["icon_source"].value}-{self._name}-{self.digest}.png'
 
     @property
     def original_file_path(self):
@@ -207,22 +326,64 @@ class IconLayer(ABC):
 
     @property
     def id(self):
-        return self.__hash__()
+        return self.digest
 
     def get_image(self):
-        if self._is_generated or ENV_ENABLE_CACHE and os.path.exists(self._generated_path):
-            try:
-                return Image.open(self._generated_path).convert('RGBA')
-            except Exception:
+        layer_id = self.id
+        img = IconLayer._cached_images.get(layer_id) if ENV_ENABLE_CACHE else None
+        if img:
+            return img
+
+        img = self.rasterize()
+        if img:
+            # Layers are composited onto a canvas of the same size
+            if img.mode != 'RGBA':
+                img = img.convert('RGBA')
+            if img.size != (self._icon['max_width'], self._icon['max_height']):
+                img = IconEditor.crop(img, width=self._icon['max_width'], height=self._icon['max_height'])
+
+            IconLayer._cached_images[layer_id] = img
+
+        return img
+
+    def get_frames(self) -> Union[List[Tuple[Image.Image, int]], None]:
+        ''' List of (image, duration in ms), None = not animated '''
+        layer_id = self.id
+        if ENV_ENABLE_CACHE:
+            if layer_id in IconLayer._static_layers:
                 return None
 
-        self._is_generated = True
-        return self.rasterize()
+            frames = IconLayer._cached_frames.get(layer_id)
+            if frames:
+                return frames
+
+        frames = self.rasterize_frames()
+        animation = self._icon.get('icon_animation')
+        if animation in ANIMATIONS:
+            if not frames:
+                img = self.get_image()
+                frames = [(img, ANIMATION_FRAME_DURATION)] if img else None
+
+            if frames:
+                frames = IconEditor.animate(frames, animation)
+
+        if frames:
+            IconLayer._cached_frames[layer_id] = frames
+        else:
+            if len(IconLayer._static_layers) >= IconLayer.MAX_STATIC_LAYERS:
+                IconLayer._static_layers.clear()
+            IconLayer._static_layers.add(layer_id)
+
+        return frames
 
     @abstractmethod
     def rasterize(self):
         pass
 
+    def rasterize_frames(self):
+        # Not animated by default
+        return None
+
 
 class TextIconLayer(IconLayer):
     def is_available(self):
@@ -234,12 +395,6 @@ class TextIconLayer(IconLayer):
         img = Image.new('RGBA', (icon_styles['max_width'], icon_styles['max_height']), (0, 0, 0, 0))
         img = IconEditor.draw_texts(img, text=icon_styles['text'], color=icon_styles['text_color'], align=icon_styles['text_align'], font=icon_styles['text_font'], size=icon_styles['text_size'], offset=icon_styles['text_offset'])
 
-        # Save image
-        img.save(self._generated_path, 'PNG')
-
-        # Optimize image
-        optimize_image(self._generated_path, optimize_level=5)
-
         return img
 
 
@@ -251,27 +406,37 @@ class LocalIconLayer(IconLayer):
         icon_styles = self._icon
         icon_width, icon_height = icon_styles['icon_size']
 
-        button_width = icon_styles['max_width']
-        button_height = icon_styles['max_height']
-
         if self._original_file_path:
             # SVG to PNG
             is_svg = self._original_file_path.endswith('svg')
             if is_svg:
-                tmp_file = os.path.join(CACHE_ICONS_DIR, f'.tmp-{self.generated_filename()}')
-                cairosvg.svg2png(url=self._original_file_path, write_to=tmp_file, output_width=icon_width, output_height=icon_height)
-                img = Image.open(tmp_file)
-                os.remove(tmp_file)
+                png_data = cairosvg.svg2png(url=self._original_file_path, output_width=icon_width, output_height=icon_height)
+                img = Image.open(io.BytesIO(png_data)).convert('RGBA')
 
                 # Apply color overlay
                 img = IconEditor.apply_color(img, icon_styles['icon_color'])
             else:
-                img = Image.open(self.original_file_path).convert('RGBA')
-                img = IconEditor.resize(img, icon_styles['icon_size_mode'], icon_styles['icon_size'])
+                img = IconEditor.load_image(self._original_file_path, icon_styles['icon_size_mode'], icon_styles['icon_size'])
         else:
             # Blank icon
             img = Image.new('RGBA', (icon_width, icon_height), 0)
 
+        return self._decorate(img)
+
+    def rasterize_frames(self):
+        if not self._original_file_path or self._original_file_path.endswith('svg'):
+            return None
+
+        icon_styles = self._icon
+        frames = IconEditor.load_frames(self._original_file_path, icon_styles['icon_size_mode'], icon_styles['icon_size'])
+        if not frames:
+            return None
+
+        return [(self._decorate(img), duration) for img, duration in frames]
+
+    def _decorate(self, img: Image) -> Image:
+        icon_styles = self._icon
+
         # Apply icon's padding
         img = IconEditor.apply_padding(img, icon_styles['icon_padding'])
 
@@ -288,15 +453,16 @@ class LocalIconLayer(IconLayer):
         img = IconEditor.adjust_brightness(img, icon_styles['icon_brightness'])
 
         # Crop
-        img = IconEditor.crop(img, width=button_width, height=button_height)
+        img = IconEditor.crop(img, width=icon_styles['max_width'], height=icon_styles['max_height'])
 
-        # Save image
-        img.save(self._generated_path, 'PNG')
+        return img
 
-        # Optimize image
-        optimize_image(self._generated_path, optimize_level=5)
 
-        return img
+class PictureIconLayer(LocalIconLayer):
+    def __init__(self, icon: dict):
+        # `icon_name` is the digest of the downloaded picture, empty = not downloaded yet
+        digest = icon['icon_name']
+        super().__init__(icon, file_path=PictureProvider.file_path(digest) if digest else None)
 
 
 class RemoteIconLayer(IconLayer):
@@ -317,11 +483,12 @@ class RemoteIconLayer(IconLayer):
 class UrlIconLayer(RemoteIconLayer):
     def __init__(self, icon: dict):
         self._url = icon['icon_name']
-        icon['icon_name'] = f'{hash(self._url):0x}'
+        icon['icon_name'] = url_cache.digest(self._url)
+        # Changes the layer's ID when the downloaded image changes
+        icon['icon_version'] = url_cache.version(self._url)
         self._name = icon['icon_name']
 
-        file_path = os.path.join(CACHE_ICONS_DIR, icon['icon_source'].value, f'{self._name}.png')
-        super().__init__(icon, file_path=file_path)
+        super().__init__(icon, file_path=url_cache.file_path(self._url))
 
     @property
     def download_url(self):
@@ -359,9 +526,16 @@ class PhosphorIconLayer(RemoteSvgIconLayer):
 
 
 class IconProvider:
+    MAX_CACHED_ICONS = 512
+
     def __init__(self):
         self._queue = asyncio.Queue()
         self._requested = set()
+        # URL -> delay before the next retry
+        self._retry_delays: Dict[str, float] = {}
+
+        # Icon's fingerprint -> Icon
+        self._cached_icons = LRUCache(IconProvider.MAX_CACHED_ICONS)
 
     async def _create_download_task(self, icon: dict):
         self._requested.add(icon.download_url)
@@ -376,47 +550,71 @@ class IconProvider:
         loop = asyncio.get_running_loop()
         loop.create_task(self._create_download_task(icon))
 
-    def get_icon(self, button_config: PageButtonConfig) -> Union[IconLayer, None]:
-        # Extract main icon's fields from PageButtoConfig
-        main_icon = {}
-        main_text_icon = {}
-
-        button_fields = [field.name for field in fields(button_config)]
-        for key in button_fields:
-            value = getattr(button_config, key)
-            # Don't set None values so we could set the default values later
-            if value is None:
-                continue
-
-            if key in ICON_FIELDS:
-                main_icon[key] = value
-            elif key in TEXT_ICON_FIELDS:
-                main_text_icon[key] = value
+    def clear_cache(self):
+        self._cached_icons.clear()
 
+    @staticmethod
+    def _fingerprint(button_config: FrozenPageButtonConfig):
+        return (
+            button_config.max_width,
+            button_config.max_height,
+            freeze(button_config.icon_fields),
+            freeze(button_config.text_icon_fields),
+            freeze(button_config.additional_icons or []),
+        )
+
+    def get_icon(self, button_config: FrozenPageButtonConfig) -> Union[Icon, None]:
+        fingerprint = None
+        if ENV_ENABLE_CACHE:
+            fingerprint = IconProvider._fingerprint(button_config)
+            icon = self._cached_icons.get(fingerprint)
+            if icon and icon.expires_at > time.time():
+                icon.touch()
+                return icon
+
+        # Icon's fields are extracted when creating FrozenPageButtonConfig
         layers = []
-        if main_icon:
-            layers.append(main_icon)
-        if main_text_icon:
-            layers.append(main_text_icon)
+        if button_config.icon_fields:
+            layers.append(dict(button_config.icon_fields))
+        if button_config.text_icon_fields:
+            layers.append(dict(button_config.text_icon_fields))
 
+        # Layers are modified by Icon, don't touch the config's dicts
         additional_icons = button_config.additional_icons or []
         if additional_icons:
-            layers += additional_icons
+            layers += [dict(icon) for icon in additional_icons]
 
-        if layers:
-            return Icon(button_config.max_width, button_config.max_height, layers)
+        if not layers:
+            return None
 
-        return None
+        icon = Icon(button_config.max_width, button_config.max_height, layers)
+        # Don't cache icons that are still waiting for downloads
+        if fingerprint and icon.is_complete():
+            self._cached_icons[fingerprint] = icon
+
+        return icon
 
     async def _worker(self):
         """Worker task that processes the queue."""
         icon: IconLayer = await self._queue.get()
-        if icon.is_available():
+        is_url = isinstance(icon, UrlIconLayer)
+        if icon.is_available() and not is_url:
+            self._requested.discard(icon.download_url)
+            self._retry_delays.pop(icon.download_url, None)
             self._queue.task_done()
             return
 
         try:
-            if isinstance(icon, RemoteIconLayer):
+            if is_url:
+                async with httpx.AsyncClient() as client:
+                    logging.info(f'Fetching icon: {icon.download_url}')
+                    changed = await url_cache.fetch(client, icon.download_url)
+
+                if changed:
+                    # Cached icons still use the old image
+                    self.clear_cache()
+                    await event_bus.publish(EventName.DECK_FORCE_RELOAD)
+            elif isinstance(icon, RemoteIconLayer):
                 async with httpx.AsyncClient() as client:
                     url = icon.download_url
                     logging.info(f'Downloading icon: {url}')
@@ -428,14 +626,46 @@ class IconProvider:
 
                         # Reload deck
                         await event_bus.publish(EventName.DECK_FORCE_RELOAD)
+        except Exception as e:
+            logging.info(f'Could not download icon: {e}')
         finally:
-            if icon.id in self._requested:
-                self._requested.remove(icon.id)
+            url = icon.download_url
+            if icon.is_available():
+                self._requested.discard(url)
+                self._retry_delays.pop(url, None)
+            else:
+                # Still marked as requested until it's retried
+                delay = min(self._retry_delays.get(url, ICON_RETRY_MIN_DELAY / 2) * 2, ICON_RETRY_MAX_DELAY)
+                self._retry_delays[url] = delay
+                asyncio.get_running_loop().call_later(delay, self._retry_download, url)
             self._queue.task_done()
 
+    def _retry_download(self, url: str):
+        self._requested.discard(url)
+        # Icons are requested again when they are rendered
+        asyncio.get_running_loop().create_task(event_bus.publish(EventName.DECK_FORCE_RELOAD))
+
 
 class IconEditor:
+    MAX_CACHED_MASKS = 64
+    MAX_CACHED_TEXTS = 512
+    MAX_CACHED_IMAGES = 64
+
     _cached_fonts = {}
+    # Only used to measure texts
+    _measure_draw = ImageDraw.Draw(Image.new('L', (1, 1)))
+    # (text, font, size) -> (width, height)
+    _cached_text_sizes = LRUCache(MAX_CACHED_TEXTS * 4)
+    # (text, font, size) -> "L" mask of the rendered text
+    _cached_text_masks = LRUCache(MAX_CACHED_TEXTS)
+    # (text, font, max_width, max_height) -> font size
+    _cached_fit_sizes = LRUCache(MAX_CACHED_TEXTS)
+    # (path, mtime, size mode, size) -> resized image
+    _cached_images = LRUCache(MAX_CACHED_IMAGES)
+    # (path, mtime, size mode, size) -> resized frames, None = not animated
+    _cached_animations = LRUCache(MAX_CACHED_IMAGES)
+    # (size, box, radius) -> "L" mask
+    _cached_masks = LRUCache(MAX_CACHED_MASKS)
 
     @staticmethod
     def apply_color(img: Image, color: str) -> Image:
@@ -496,48 +726,46 @@ class IconEditor:
 
         return new_image
 
+    @staticmethod
+    def _get_rounded_mask(size: Tuple[int, int], box: Tuple[int, int, int, int], radius: int) -> Image:
+        key = (size, box, radius)
+        mask = IconEditor._cached_masks.get(key)
+        if not mask:
+            mask = Image.new('L', size, 0)
+            ImageDraw.Draw(mask).rounded_rectangle(box, radius=radius, fill=255)
+            IconEditor._cached_masks[key] = mask
+
+        return mask
+
     @staticmethod
     def apply_border(img, *, width: int, color: str, radius: int) -> Image:
+        # Nothing to draw
+        if not width and not radius:
+            return img
+
         # Border width & color
         if width is not None and color is not None:
             # Add padding with the size of border
             img = IconEditor.apply_padding(img, padding=width)
 
-            # Create an out mask and an in mask
-            border_mask = Image.new('L', img.size, 0)
-            draw = ImageDraw.Draw(border_mask)
-            draw.rounded_rectangle(
-                [0, 0, img.width - 1, img.height - 1], radius=radius, fill=255
-            )
-
-            mask = Image.new('L', img.size, 0)
-            draw = ImageDraw.Draw(mask)
-            draw.rounded_rectangle(
-                [
-                    width,
-                    width,
-                    img.width - width - 1,
-                    img.height - width - 1,
-                ],
-                radius=max(0, radius - width),
-                fill=255,
-            )
-
-            border_image = Image.new('RGBA', img.size, color=hex_to_rgb(color, alpha=255))
-            new_image = Image.new('RGBA', img.size, color=0)
-            # Add the border by pasting the border images onto the new image
-            new_image.paste(border_image, (0, 0), mask=border_mask)
+            # Out mask (border) and in mask (image)
+            border_mask = IconEditor._get_rounded_mask(img.size, (0, 0, img.width - 1, img.height - 1), radius or 0)
+            mask = IconEditor._get_rounded_mask(img.size, (width, width, img.width - width - 1, img.height - width - 1), max(0, (radius or 0) - width))
+
+            # Fill the border color, then paste the image inside the border
+            new_image = Image.new('RGBA', img.size, color=hex_to_rgb(color, alpha=255))
+            new_image.putalpha(border_mask)
             new_image.paste(img, mask=mask)
 
-            img = new_image
+            # Corners are already rounded by border_mask
+            return new_image
 
         # Border radius
-        if radius is not None:
-            border_mask = Image.new('L', img.size, 0)
-            mask_draw = ImageDraw.Draw(border_mask)
-            mask_draw.rounded_rectangle((0, 0, img.width, img.height), radius, fill=255)
+        if radius:
+            border_mask = IconEditor._get_rounded_mask(img.size, (0, 0, img.width, img.height), radius)
 
-            img.paste(img, mask=border_mask)
+            img = img.copy()
+            img.putalpha(ImageChops.multiply(img.getchannel('A'), border_mask))
 
         return img
 
@@ -553,20 +781,72 @@ class IconEditor:
         return enhancer.enhance(brightness / 100)
 
     @staticmethod
-    def draw_texts(img: Image, *, text: str, color: str, align: str, font: str, size: int, offset: int):
+    def _get_font(font: str, size: int) -> ImageFont.FreeTypeFont:
+        font_key = f'{font}-{size}'
+        if font_key not in IconEditor._cached_fonts:
+            IconEditor._cached_fonts[font_key] = ImageFont.truetype(os.path.join(FONTS_DIR, f'{font}.ttf'), size)
+
+        return IconEditor._cached_fonts[font_key]
+
+    @staticmethod
+    def measure_text(text: str, *, font: str, size: int) -> Tuple[int, int]:
+        key = (text, font, size)
+        text_size = IconEditor._cached_text_sizes.get(key)
+        if not text_size:
+            bbox = IconEditor._measure_draw.multiline_textbbox((0, 0), text, font=IconEditor._get_font(font, size), spacing=TEXT_LINE_SPACING, align=TEXT_LINE_ALIGN)
+            text_size = tuple(bbox[2:])
+            IconEditor._cached_text_sizes[key] = text_size
+
+        return text_size
+
+    @staticmethod
+    def fit_text_size(text: str, *, font: str, max_width: int, max_height: int) -> int:
+        # Find the largest size that fits using cached measurements only
+        key = (text, font, max_width, max_height)
+        if key in IconEditor._cached_fit_sizes:
+            return IconEditor._cached_fit_sizes.get(key)
+
+        low, high = MIN_TEXT_SIZE, max(MIN_TEXT_SIZE, max_height)
+        while low < high:
+            size = (low + high + 1) // 2
+            text_width, text_height = IconEditor.measure_text(text, font=font, size=size)
+            if text_width <= max_width and text_height <= max_height:
+                low = size
+            else:
+                high = size - 1
+
+        IconEditor._cached_fit_sizes[key] = low
+        return low
+
+    @staticmethod
+    def _get_text_mask(text: str, *, font: str, size: int) -> Union[Image.Image, None]:
+        # Rendered glyphs of the text, used as an alpha mask
+        key = (text, font, size)
+        if key in IconEditor._cached_text_masks:
+            return IconEditor._cached_text_masks.get(key)
+
+        mask = None
+        text_width, text_height = IconEditor.measure_text(text, font=font, size=size)
+        if text_width > 0 and text_height > 0:
+            mask = Image.new('L', (text_width, text_height), 0)
+            ImageDraw.Draw(mask).multiline_text((0, 0), text, font=IconEditor._get_font(font, size), fill=255, spacing=TEXT_LINE_SPACING, align=TEXT_LINE_ALIGN)
+
+        IconEditor._cached_text_masks[key] = mask
+        return mask
+
+    @staticmethod
+    def draw_texts(img: Image, *, text: str, color: str, align: str, font: str, size: Union[int, str], offset: int):
         if not text or not color or not font or not size:
             return img
 
-        font_key = f'{font}-{size}'
-        if font_key not in IconEditor._cached_fonts:
-            font = ImageFont.truetype(f'assets/fonts/{font}.ttf', size)
-            IconEditor._cached_fonts[font_key] = font
-        else:
-            font = IconEditor._cached_fonts[font_key]
+        if size == TEXT_SIZE_AUTO:
+            size = IconEditor.fit_text_size(text, font=font, max_width=img.width, max_height=img.height)
 
-        draw = ImageDraw.Draw(img)
+        mask = IconEditor._get_text_mask(text, font=font, size=size)
+        if not mask:
+            return img
 
-        text_width, text_height = draw.textbbox((0, 0), text, font=font)[2:]
+        text_width, text_height = mask.size
 
         x = (img.width - text_width) // 2
         if align == 'top':
@@ -580,7 +860,7 @@ class IconEditor:
         x += offset[0]
         y += offset[1]
 
-        draw.text((x, y), text, font=font, fill=hex_to_rgb(color))
+        img.paste(hex_to_rgb(color), (x, y), mask)
 
         return img
 
@@ -590,6 +870,80 @@ class IconEditor:
         new_img.paste(img, ((width - img.width) // 2, (height - img.height) // 2))
         return new_img
 
+    @staticmethod
+    def load_image(file_path: str, mode: str, size: Tuple[int, int]) -> Image:
+        # Pre-scaled images, the modified time invalidates edited files
+        key = (file_path, os.stat(file_path).st_mtime_ns, mode, size)
+        img = IconEditor._cached_images.get(key)
+        if img:
+            return img
+
+        with Image.open(file_path) as source:
+            if source.format == 'JPEG':
+                # Let the JPEG decoder downscale while decoding (1/2, 1/4, 1/8)
+                try:
+                    source.draft('RGB', size)
+                except Exception:
+                    pass
+
+            img = source.convert('RGBA')
+
+        img = IconEditor.resize(img, mode, size)
+        IconEditor._cached_images[key] = img
+
+        return img
+
+    @staticmethod
+    def load_frames(file_path: str, mode: str, size: Tuple[int, int]) -> Union[List[Tuple[Image.Image, int]], None]:
+        ''' Frames of animated GIF/PNG/WebP files, None = not animated '''
+        key = (file_path, os.stat(file_path).st_mtime_ns, mode, size)
+        if key in IconEditor._cached_animations:
+            return IconEditor._cached_animations.get(key)
+
+        frames = None
+        with Image.open(file_path) as source:
+            frame_count = getattr(source, 'n_frames', 1)
+            if frame_count > 1:
+                # Drop frames of long animations, keep their durations
+                step = math.ceil(frame_count / ANIMATION_MAX_FRAMES)
+                frames = []
+                for index in range(0, frame_count, step):
+                    duration = 0
+                    for sub_index in range(index, min(index + step, frame_count)):
+                        source.seek(sub_index)
+                        duration += source.info.get('duration') or ANIMATION_FRAME_DURATION
+
+                    source.seek(index)
+                    img = IconEditor.resize(source.convert('RGBA'), mode, size)
+                    frames.append((img, int(duration)))
+
+        IconEditor._cached_animations[key] = frames
+        return frames
+
+    @staticmethod
+    def animate(frames: List[Tuple[Image.Image, int]], animation: str) -> List[Tuple[Image.Image, int]]:
+        ''' Generate frames of built-in animations '''
+        if animation == ANIMATION_SPIN:
+            # Rotate a single image, or each frame of an animated image
+            if len(frames) == 1:
+                img, duration = frames[0]
+                frames = [(img, duration)] * ANIMATION_SPIN_FRAMES
+
+            total = len(frames)
+            return [
+                (img.rotate(-360 * index / total, resample=Image.BICUBIC), duration)
+                for index, (img, duration) in enumerate(frames)
+            ]
+        elif animation == ANIMATION_BLINK:
+            output = []
+            for img, duration in frames:
+                blank = Image.new('RGBA', img.size, (0, 0, 0, 0))
+                output += [(img, max(duration, 500)), (blank, max(duration, 500))]
+
+            return output
+
+        return frames
+
     @staticmethod
     def resize(img: Image, mode: str, size: Tuple[int, int]) -> Image:
         icon_width, icon_height = size
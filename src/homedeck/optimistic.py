@@ -0,0 +1,95 @@
+import asyncio
+import os
+from typing import Callable, Dict, Union
+
+from .home_assistant import HomeAssistantWebSocket
+
+# Seconds to wait for Home Assistant to report a predicted state before going back to the previous one
+OPTIMISTIC_TIMEOUT = float(os.getenv('OPTIMISTIC_TIMEOUT', 5))
+
+# Entities with simple "on"/"off" states
+OPTIMISTIC_DOMAINS = {'light', 'switch', 'fan'}
+OPTIMISTIC_SERVICES = {'toggle', 'turn_on', 'turn_off'}
+
+
+class OptimisticStates:
+    '''
+    Predicts states of entities after a service call, so their buttons are updated without waiting for Home Assistant.
+    Predictions are replaced by the states reported by Home Assistant,
+    or rolled back when the call fails or nothing is reported in time.
+    '''
+
+    def __init__(self, ha: HomeAssistantWebSocket, on_changed: Callable[[], None], *, timeout: float = OPTIMISTIC_TIMEOUT):
+        self._ha = ha
+        self._on_changed = on_changed
+        self._timeout = timeout
+        # Entity ID -> rollback timer
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+
+    def predict(self, *, domain: str, service: str, service_data: dict) -> bool:
+        ''' Returns True when a state was predicted '''
+        if service not in OPTIMISTIC_SERVICES or domain not in OPTIMISTIC_DOMAINS | {'homeassistant'}:
+            return False
+
+        changed = False
+        for entity_id in OptimisticStates._get_entity_ids(service_data):
+            state = self._predict_state(entity_id, service)
+            if state and self._ha.predict_state(entity_id, state):
+                self._schedule_rollback(entity_id)
+                changed = True
+
+        if changed:
+            self._on_changed()
+        return changed
+
+    def rollback(self, service_data: dict):
+        ''' Called when the service call failed '''
+        changed = False
+        for entity_id in OptimisticStates._get_entity_ids(service_data):
+            timer = self._timers.pop(entity_id, None)
+            if timer:
+                timer.cancel()
+
+            if self._ha.discard_prediction(entity_id):
+                changed = True
+
+        if changed:
+            self._on_changed()
+
+    def _predict_state(self, entity_id: str, service: str) -> Union[str, None]:
+        if entity_id.split('.', 1)[0] not in OPTIMISTIC_DOMAINS:
+            return None
+
+        current_state = self._ha.all_states.get(entity_id)
+        # Unknown, unavailable...
+        if not current_state or current_state['state'] not in ('on', 'off'):
+            return None
+
+        if service == 'toggle':
+            return 'off' if current_state['state'] == 'on' else 'on'
+
+        state = 'on' if service == 'turn_on' else 'off'
+        return state if state != current_state['state'] else None
+
+    def _schedule_rollback(self, entity_id: str):
+        timer = self._timers.pop(entity_id, None)
+        if timer:
+            timer.cancel()
+
+        self._timers[entity_id] = asyncio.get_running_loop().call_later(self._timeout, self._on_timeout, entity_id)
+
+    def _on_timeout(self, entity_id: str):
+        self._timers.pop(entity_id, None)
+
+        # Already confirmed otherwise
+        if self._ha.discard_prediction(entity_id):
+            print('⚠️', 'No state reported in time, rolled back', entity_id)
+            self._on_changed()
+
+    @staticmethod
+    def _get_entity_ids(service_data: dict):
+        entity_ids = (service_data or {}).get('entity_id') or []
+        if isinstance(entity_ids, str):
+            entity_ids = [entity_id.strip() for entity_id in entity_ids.split(',')]
+
+        return entity_ids
@@ -0,0 +1,79 @@
+import struct
+import time
+import zlib
+from typing import Iterable, List
+
+from strmdck.utils import random_string
+
+# Same compression level as the device driver
+COMPRESS_LEVEL = 1
+# There is a bug with the deck when byte value at 1016, 1016 + 1024... is one of these
+INVALID_BYTES = (b'\x00', b'\x7c')
+
+
+class ZipEntry:
+    ''' A compressed file, ready to be written into any archive '''
+
+    __slots__ = ('name', 'crc', 'size', 'compressed', 'dos_time', 'dos_date')
+
+    def __init__(self, name: str, data: bytes):
+        self.name = name.encode('utf-8')
+        self.crc = zlib.crc32(data)
+        self.size = len(data)
+
+        compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -15)
+        self.compressed = compressor.compress(data) + compressor.flush()
+
+        now = time.localtime()
+        self.dos_time = (now.tm_hour << 11) | (now.tm_min << 5) | (now.tm_sec // 2)
+        self.dos_date = ((now.tm_year - 1980) << 9) | (now.tm_mon << 5) | now.tm_mday
+
+
+def build_zip(entries: Iterable[ZipEntry]) -> bytes:
+    ''' Writes a zip archive in memory, entries are not compressed again '''
+    local_parts = []
+    central_parts = []
+    offset = 0
+    count = 0
+
+    for entry in entries:
+        local_header = struct.pack(
+            '<IHHHHHIIIHH',
+            0x04034b50, 20, 0, zlib.DEFLATED, entry.dos_time, entry.dos_date,
+            entry.crc, len(entry.compressed), entry.size, len(entry.name), 0,
+        )
+        local_parts += (local_header, entry.name, entry.compressed)
+
+        central_parts += (struct.pack(
+            '<IHHHHHHIIIHHHHHII',
+            0x02014b50, 0x0314, 20, 0, zlib.DEFLATED, entry.dos_time, entry.dos_date,
+            entry.crc, len(entry.compressed), entry.size, len(entry.name), 0, 0, 0, 0, 0o600 << 16, offset,
+        ), entry.name)
+
+        offset += len(local_header) + len(entry.name) + len(entry.compressed)
+        count += 1
+
+    central_directory = b''.join(central_parts)
+    end_record = struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, count, count, len(central_directory), offset, 0)
+
+    return b''.join(local_parts) + central_directory + end_record
+
+
+def is_valid_zip(data: bytes) -> bool:
+    return not any(data[i:i + 1] in INVALID_BYTES for i in range(1016, len(data), 1024))
+
+
+def build_upload(entries: List[ZipEntry]) -> bytes:
+    ''' Zip archive accepted by the deck, a dummy file is added at the beginning until it's valid '''
+    dummy_str = ''
+    dummy_retries = 0
+    data = build_zip(entries)
+
+    while not is_valid_zip(data):
+        # Add a dummy file with random string at the beginning to modify the zip
+        print('Generating dummy string...')
+        dummy_retries += 1
+        dummy_str += random_string(8 * dummy_retries)
+        data = build_zip([ZipEntry('dummy.txt', dummy_str.encode('utf-8'))] + entries)
+
+    return data
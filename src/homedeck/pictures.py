@@ -0,0 +1,204 @@
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Tuple, Union
+from urllib.parse import urlsplit
+
+import httpx
+from PIL import Image
+
+from .event_bus import EventName, event_bus
+from .utils import LRUCache
+
+PICTURE_CACHE_DIR = os.path.join('.cache', 'icons', 'picture')
+# Minimum number of seconds between two downloads of the same button's picture, when its URL changes
+PICTURE_REFRESH_INTERVAL = float(os.getenv('PICTURE_REFRESH_INTERVAL', 10))
+MAX_PICTURE_FILES = 64
+
+
+class PictureProvider:
+    '''
+    Downloads `entity_picture` of entities (camera snapshots, album art...) when their URLs change.
+    Pictures are stored as `<digest>.png`, the digest changes when the picture changes.
+    '''
+
+    def __init__(self):
+        self._base_url = None
+        self._token = None
+        self._client: Union[httpx.AsyncClient, None] = None
+
+        # (entity_id, size) -> digest of the current picture
+        self._digests: Dict[Tuple, str] = {}
+        # (entity_id, size) -> URL of the current picture
+        self._urls: Dict[Tuple, str] = {}
+        # (entity_id, size) -> last download time
+        self._fetched_at: Dict[Tuple, float] = {}
+        # (entity_id, size) -> URL waiting for the next allowed download
+        self._pending: Dict[Tuple, str] = {}
+        self._fetching = set()
+
+        # Payload's digest -> picture's digest
+        self._payload_digests = LRUCache(MAX_PICTURE_FILES)
+        # Digest -> file path, oldest first. Loaded from the disk on the first write
+        self._files: Union[OrderedDict, None] = None
+
+    def setup(self, host: str, token: str):
+        # ws://host:8123 -> http://host:8123
+        host = (host or '').rstrip('/')
+        if host.startswith('ws'):
+            host = 'http' + host[2:]
+
+        self._base_url = host
+        self._token = token
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Reuse connections to Home Assistant
+        if not self._client:
+            self._client = httpx.AsyncClient(
+                base_url=self._base_url or '',
+                limits=httpx.Limits(max_connections=4, max_keepalive_connections=4),
+                timeout=10,
+            )
+
+        return self._client
+
+    def _headers(self, url: str) -> Union[Dict[str, str], None]:
+        ''' The token is only sent to Home Assistant, not to other hosts (album art...) '''
+        if not self._token:
+            return None
+
+        parts = urlsplit(url)
+        if parts.scheme or parts.netloc:
+            base_parts = urlsplit(self._base_url or '')
+            if (parts.scheme, parts.netloc) != (base_parts.scheme, base_parts.netloc):
+                return None
+
+        return {'Authorization': f'Bearer {self._token}'}
+
+    @staticmethod
+    def file_path(digest: str) -> str:
+        return os.path.join(PICTURE_CACHE_DIR, f'{digest}.png')
+
+    def resolve(self, entity_id: str, *, all_states: dict, size: Tuple[int, int]) -> str:
+        ''' Returns digest of the latest picture, schedules a download when it's allowed '''
+        key = (entity_id, tuple(size))
+        url = all_states.get(entity_id, {}).get('attributes', {}).get('entity_picture')
+        if url:
+            self._request(key, url)
+
+        return self._digests.get(key, '')
+
+    def _request(self, key: Tuple, url: str):
+        # Home Assistant changes the URL when the picture changes (and when its token expires)
+        if url == self._urls.get(key) and key not in self._pending:
+            return
+
+        if key in self._fetching:
+            self._pending[key] = url
+            return
+
+        wait_time = self._fetched_at.get(key, 0) + PICTURE_REFRESH_INTERVAL - time.time()
+        if wait_time > 0:
+            # Download it later
+            if key not in self._pending:
+                asyncio.get_running_loop().call_later(wait_time, self._fetch_pending, key)
+            self._pending[key] = url
+            return
+
+        self._fetching.add(key)
+        self._fetched_at[key] = time.time()
+        asyncio.get_running_loop().create_task(self._fetch(key, url))
+
+    def _fetch_pending(self, key: Tuple):
+        url = self._pending.pop(key, None)
+        if url:
+            self._request(key, url)
+
+    async def _fetch(self, key: Tuple, url: str):
+        try:
+            response = await self.client.get(url, headers=self._headers(url))
+            if response.status_code != 200:
+                logging.info(f'Could not download picture of {key[0]}: {response.status_code}')
+                return
+
+            payload = response.content
+            payload_digest = hashlib.sha1(payload).hexdigest()
+
+            # Same picture as before
+            digest = self._payload_digests.get((payload_digest, key[1]))
+            if not digest or not os.path.exists(PictureProvider.file_path(digest)):
+                # Decode and resize it outside of the event loop
+                loop = asyncio.get_running_loop()
+                png_data = await loop.run_in_executor(None, PictureProvider._process, payload, key[1])
+
+                digest = hashlib.sha1(png_data).hexdigest()
+                self._save(digest, png_data)
+                self._payload_digests[(payload_digest, key[1])] = digest
+
+            self._urls[key] = url
+            if self._digests.get(key) != digest:
+                self._digests[key] = digest
+                await event_bus.publish(EventName.DECK_RELOAD)
+        except Exception as e:
+            logging.info(f'Could not download picture of {key[0]}: {e}')
+        finally:
+            self._fetching.discard(key)
+            if key in self._pending:
+                self._fetch_pending(key)
+
+    @staticmethod
+    def _process(payload: bytes, size: Tuple[int, int]) -> bytes:
+        with Image.open(io.BytesIO(payload)) as source:
+            if source.format == 'JPEG':
+                source.draft('RGB', size)
+
+            img = source.convert('RGBA')
+
+        img.thumbnail(size, Image.LANCZOS)
+
+        output = io.BytesIO()
+        img.save(output, 'PNG', compress_level=1)
+        return output.getvalue()
+
+    def _load_files(self) -> OrderedDict:
+        ''' Pictures written by previous runs are removed like the others '''
+        files = []
+        try:
+            with os.scandir(PICTURE_CACHE_DIR) as it:
+                for entry in it:
+                    if entry.is_file() and entry.name.endswith('.png'):
+                        files.append((entry.stat().st_mtime, entry.name[:-len('.png')], entry.path))
+        except FileNotFoundError:
+            pass
+
+        files.sort()
+        return OrderedDict((digest, file_path) for _, digest, file_path in files)
+
+    def _save(self, digest: str, png_data: bytes):
+        if self._files is None:
+            self._files = self._load_files()
+
+        file_path = PictureProvider.file_path(digest)
+        if not os.path.exists(file_path):
+            os.makedirs(PICTURE_CACHE_DIR, exist_ok=True)
+            with open(file_path, 'wb') as fp:
+                fp.write(png_data)
+
+        self._files[digest] = file_path
+        self._files.move_to_end(digest)
+
+        # Remove old pictures
+        while len(self._files) > MAX_PICTURE_FILES:
+            _, old_path = self._files.popitem(last=False)
+            try:
+                os.remove(old_path)
+            except FileNotFoundError:
+                pass
+
+
+picture_provider = PictureProvider()
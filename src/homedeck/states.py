@@ -0,0 +1,141 @@
+import sys
+from collections.abc import Mapping
+from typing import AbstractSet, Dict, Iterable, Iterator, Union
+
+# Attributes read by HomeDeck itself, templates can read others
+BUILTIN_ATTRIBUTES = frozenset({'friendly_name', 'icon', 'device_class', 'unit_of_measurement', 'entity_picture'})
+# Longer states (or numbers) are unlikely to be repeated, don't intern them
+MAX_INTERNED_STATE_LENGTH = 32
+
+
+def _intern_state(state: str) -> str:
+    if len(state) > MAX_INTERNED_STATE_LENGTH or state[:1].isdigit() or state[:1] == '-':
+        return state
+
+    return sys.intern(state)
+
+
+class EntityState(Mapping):
+    '''
+    Read-only state of an entity, used like Home Assistant's state dicts: `state['state']`, `state.get('attributes', {})`.
+    Only `entity_id`, `state` and `attributes` are kept.
+    '''
+
+    __slots__ = ('entity_id', 'state', 'attributes')
+    _KEYS = ('entity_id', 'state', 'attributes')
+
+    def __init__(self, entity_id: str, state: str, attributes: Dict):
+        self.entity_id = entity_id
+        self.state = state
+        self.attributes = attributes
+
+    def __getitem__(self, key):
+        if key in self._KEYS:
+            return getattr(self, key)
+
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self._KEYS)
+
+    def __len__(self):
+        return len(self._KEYS)
+
+    def __eq__(self, other):
+        if isinstance(other, EntityState):
+            return self.entity_id == other.entity_id and self.state == other.state and self.attributes == other.attributes
+
+        return Mapping.__eq__(self, other)
+
+    def __repr__(self):
+        return f'EntityState({self.entity_id}={self.state!r}, {self.attributes!r})'
+
+    def with_state(self, state: str) -> 'EntityState':
+        return EntityState(self.entity_id, _intern_state(state), self.attributes)
+
+
+class StateStore(Mapping):
+    '''
+    Entity ID -> EntityState, a read-only view for the configuration, templates and pages.
+    Entity IDs and common states are interned, unused attributes are dropped
+    so memory doesn't grow with the number of attributes of the house.
+    '''
+
+    def __init__(self):
+        self._states: Dict[str, EntityState] = {}
+        # Attribute names to keep, None means all
+        self._attribute_names: Union[AbstractSet[str], None] = None
+
+    def __getitem__(self, entity_id: str) -> EntityState:
+        return self._states[entity_id]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._states)
+
+    def __len__(self):
+        return len(self._states)
+
+    def __contains__(self, entity_id):
+        return entity_id in self._states
+
+    def get(self, entity_id: str, default=None):
+        return self._states.get(entity_id, default)
+
+    @property
+    def attribute_names(self) -> Union[AbstractSet[str], None]:
+        return self._attribute_names
+
+    def keep_attributes(self, attribute_names: Union[Iterable[str], None]) -> bool:
+        '''
+        Only keep `attribute_names` (and the built-in ones) from now on, None to keep all of them.
+        Returns True when states must be received again because some attributes were dropped before.
+        '''
+        if attribute_names is not None:
+            attribute_names = BUILTIN_ATTRIBUTES | frozenset(sys.intern(name) for name in attribute_names)
+
+        old_names = self._attribute_names
+        self._attribute_names = attribute_names
+
+        if attribute_names is None:
+            return old_names is not None
+
+        if old_names is not None and not attribute_names <= old_names:
+            return True
+
+        # Narrower than before: drop the others now
+        for entity_id, state in self._states.items():
+            if any(name not in attribute_names for name in state.attributes):
+                self._states[entity_id] = EntityState(entity_id, state.state, self._filter_attributes(state.attributes))
+
+        return False
+
+    def make_state(self, entity_id: str, state: str, attributes: Dict) -> EntityState:
+        return EntityState(sys.intern(entity_id), _intern_state(state), self._filter_attributes(attributes))
+
+    def apply_diff(self, old_state: EntityState, *, state: str = None, attributes: Dict = None, removed_attributes: Iterable[str] = ()) -> EntityState:
+        new_attributes = old_state.attributes
+        if attributes or removed_attributes:
+            new_attributes = {**new_attributes, **self._filter_attributes(attributes or {})}
+            for name in removed_attributes:
+                new_attributes.pop(name, None)
+
+        return EntityState(old_state.entity_id, _intern_state(state) if state is not None else old_state.state, new_attributes)
+
+    def set_state(self, entity_state: EntityState):
+        self._states[entity_state.entity_id] = entity_state
+
+    def pop(self, entity_id: str, default=None):
+        return self._states.pop(entity_id, default)
+
+    def retain(self, entity_ids: Iterable[str]):
+        ''' Remove states of other entities '''
+        entity_ids = set(entity_ids)
+        for entity_id in [entity_id for entity_id in self._states if entity_id not in entity_ids]:
+            del self._states[entity_id]
+
+    def _filter_attributes(self, attributes: Dict) -> Dict:
+        attribute_names = self._attribute_names
+        if attribute_names is None:
+            return {sys.intern(name): value for name, value in attributes.items()}
+
+        return {sys.intern(name): value for name, value in attributes.items() if name in attribute_names}
@@ -0,0 +1,139 @@
+import atexit
+import hashlib
+import os
+import shutil
+import time
+from typing import AbstractSet, Callable, Dict, List, Tuple, Union
+
+# Hot directories are moved to this RAM-backed directory (tmpfs), set it to empty to keep them on disk
+STORAGE_RAM_DIR = os.getenv('STORAGE_RAM_DIR', os.path.join('/dev/shm', 'homedeck'))
+# Maximum size of generated icons kept in RAM, in bytes
+STORAGE_RAM_MAX_SIZE = int(os.getenv('STORAGE_RAM_MAX_SIZE', 32 * 1024 * 1024))
+# Minimum number of seconds between two flushes of durable caches
+STORAGE_FLUSH_INTERVAL = float(os.getenv('STORAGE_FLUSH_INTERVAL', 60))
+
+
+class Storage:
+    '''
+    Two storage tiers:
+    - hot directories (generated icons, pictures...) are volatile and live on tmpfs when it's available.
+      The original paths become symlinks, so other code (and the device driver) keeps using them.
+    - durable caches (downloaded images...) stay on disk, their indexes are flushed in batches while idle.
+    '''
+
+    def __init__(self, ram_dir: str = STORAGE_RAM_DIR):
+        self._ram_dir = ram_dir
+        # Path -> (max_size, on_evicted, in_use)
+        self._hot_dirs: Dict[str, Tuple[int, Union[Callable, None], Union[Callable, None]]] = {}
+        self._flush_callbacks: List[Callable] = []
+        self._maintained_at = time.time()
+
+    def _ram_path(self, path: str) -> Union[str, None]:
+        if not self._ram_dir or not os.path.isdir(os.path.dirname(self._ram_dir.rstrip(os.sep)) or os.sep):
+            return None
+
+        # Don't mix up files of instances running in different folders
+        instance_id = hashlib.sha1(os.getcwd().encode('utf-8')).hexdigest()[:8]
+        return os.path.join(self._ram_dir, instance_id, path.strip(os.sep).replace(os.sep, '-').lstrip('.'))
+
+    def hot_dir(self, path: str, *, max_size: int = 0, on_evicted: Callable = None, in_use: Callable[[], AbstractSet[str]] = None) -> str:
+        '''
+        Empties `path` and moves it to RAM.
+        When `max_size` is set, the least recently used files (by mtime, touch them when they are reused) are removed
+        once it's exceeded, then `on_evicted` is called. Names of files returned by `in_use()` are never removed.
+        '''
+        ram_path = self._ram_path(path)
+        if ram_path:
+            try:
+                shutil.rmtree(ram_path, ignore_errors=True)
+                os.makedirs(ram_path, exist_ok=True)
+
+                if os.path.islink(path):
+                    os.remove(path)
+                elif os.path.exists(path):
+                    # Files from before, on disk
+                    shutil.rmtree(path)
+
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                os.symlink(os.path.abspath(ram_path), path, target_is_directory=True)
+            except OSError as e:
+                print('Storage: could not use', ram_path, e)
+                ram_path = None
+
+        if not ram_path:
+            if os.path.islink(path):
+                os.remove(path)
+            elif os.path.exists(path):
+                shutil.rmtree(path)
+
+            os.makedirs(path, exist_ok=True)
+
+        self._hot_dirs[path] = (max_size, on_evicted, in_use)
+        return path
+
+    def on_flush(self, callback: Callable):
+        ''' `callback` writes a durable cache to disk, called in batches by `maintain()` '''
+        self._flush_callbacks.append(callback)
+
+    def flush(self):
+        for callback in self._flush_callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print('Storage: could not flush', e)
+
+    def maintain(self, *, force=False) -> bool:
+        '''
+        Trims hot directories and flushes durable caches, should be called while idle.
+        Returns True when files were evicted.
+        '''
+        if not force and time.time() - self._maintained_at < STORAGE_FLUSH_INTERVAL:
+            return False
+
+        self._maintained_at = time.time()
+        self.flush()
+
+        evicted = False
+        for path, (max_size, on_evicted, in_use) in self._hot_dirs.items():
+            if max_size > 0 and Storage._trim(path, max_size, in_use() if in_use else ()):
+                evicted = True
+                if on_evicted:
+                    on_evicted()
+
+        return evicted
+
+    @staticmethod
+    def _trim(path: str, max_size: int, in_use: AbstractSet[str] = ()) -> bool:
+        files = []
+        total_size = 0
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.is_file():
+                        stat = entry.stat()
+                        total_size += stat.st_size
+                        if entry.name not in in_use:
+                            files.append((stat.st_mtime, stat.st_size, entry.path))
+        except FileNotFoundError:
+            return False
+
+        if total_size <= max_size:
+            return False
+
+        # Remove the oldest files, leave some room to avoid trimming again soon
+        files.sort()
+        for _, size, file_path in files:
+            if total_size <= max_size * 3 // 4:
+                break
+
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+        return True
+
+
+storage = Storage()
+atexit.register(storage.flush)
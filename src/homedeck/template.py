@@ -98,6 +98,10 @@ def render_template(source, all_states: dict, entity_id=None):
     elif isinstance(source, list):
         return [render_template(v, all_states, entity_id=entity_id) for v in source]
     elif isinstance(source, str):
+        # Plain text, no need to compile it
+        if not has_jinja_template(source):
+            return source.strip()
+
         try:
             return env.from_string(source).render(
                 state_attr=ft.partial(_state_attr, all_states=all_states),
@@ -0,0 +1,187 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from typing import Dict, Union
+
+import httpx
+
+from .storage import storage
+
+URL_CACHE_DIR = os.path.join('.cache', 'icons', 'url')
+# Maximum disk usage of downloaded images, in bytes
+URL_CACHE_MAX_SIZE = int(os.getenv('URL_CACHE_MAX_SIZE', 50 * 1024 * 1024))
+# Used when the server doesn't send "Cache-Control: max-age"
+URL_CACHE_DEFAULT_MAX_AGE = 24 * 60 * 60
+# Images are never revalidated more often than this, even with "no-cache" or "max-age=0"
+URL_CACHE_MIN_MAX_AGE = 60
+
+
+class UrlCache:
+    '''
+    Persistent cache of downloaded images.
+    Files are named after a stable digest of the URL, response metadata is saved in `index.json`.
+    '''
+
+    def __init__(self, cache_dir: str = URL_CACHE_DIR, max_size: int = URL_CACHE_MAX_SIZE):
+        self._cache_dir = cache_dir
+        self._index_path = os.path.join(cache_dir, 'index.json')
+        self._max_size = max_size
+
+        self._entries: Union[Dict[str, Dict], None] = None
+        self._is_dirty = False
+
+    @staticmethod
+    def digest(url: str) -> str:
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()[:32]
+
+    def file_path(self, url: str) -> str:
+        return os.path.join(self._cache_dir, f'{UrlCache.digest(url)}.png')
+
+    @property
+    def entries(self) -> Dict[str, Dict]:
+        if self._entries is None:
+            self._entries = {}
+            try:
+                with open(self._index_path, 'r', encoding='utf-8') as fp:
+                    self._entries = json.load(fp)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print('UrlCache: invalid index', e)
+
+        return self._entries
+
+    def version(self, url: str) -> str:
+        ''' Digest of the cached content, changes when the image changes '''
+        return self.entries.get(UrlCache.digest(url), {}).get('content_digest', '')
+
+    def expires_at(self, url: str) -> float:
+        return self.entries.get(UrlCache.digest(url), {}).get('expires_at', 0)
+
+    def is_stale(self, url: str) -> bool:
+        return self.expires_at(url) <= time.time()
+
+    def touch(self, url: str):
+        entry = self.entries.get(UrlCache.digest(url))
+        if entry:
+            # Only used for eviction, saved with the next write
+            entry['accessed_at'] = time.time()
+
+    async def fetch(self, client: httpx.AsyncClient, url: str) -> bool:
+        ''' Download or revalidate the image. Returns True when the content changed '''
+        digest = UrlCache.digest(url)
+        file_path = self.file_path(url)
+        entry = self.entries.get(digest, {})
+
+        # Conditional request
+        headers = {}
+        if os.path.exists(file_path):
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        try:
+            response = await client.get(url, headers=headers, timeout=5, follow_redirects=True)
+        except httpx.HTTPError:
+            self._postpone(entry)
+            raise
+
+        now = time.time()
+
+        if response.status_code == 304:
+            entry['expires_at'] = now + UrlCache._max_age(response)
+            entry['accessed_at'] = now
+            self._is_dirty = True
+            return False
+
+        if response.status_code != 200:
+            logging.info(f'Could not download {url}: {response.status_code}')
+            self._postpone(entry)
+            return False
+
+        content = response.content
+        content_digest = hashlib.sha1(content).hexdigest()
+        changed = content_digest != entry.get('content_digest') or not os.path.exists(file_path)
+
+        if changed:
+            os.makedirs(self._cache_dir, exist_ok=True)
+            tmp_path = f'{file_path}.tmp'
+            with open(tmp_path, 'wb') as fp:
+                fp.write(content)
+            os.replace(tmp_path, file_path)
+
+        self.entries[digest] = {
+            'url': url,
+            'size': len(content),
+            'content_digest': content_digest,
+            'etag': response.headers.get('etag'),
+            'last_modified': response.headers.get('last-modified'),
+            'expires_at': now + UrlCache._max_age(response),
+            'accessed_at': now,
+        }
+        self._is_dirty = True
+
+        self._evict(keep=digest)
+
+        return changed
+
+    def _postpone(self, entry: Dict):
+        ''' Keep using the cached image for a while when it can't be revalidated '''
+        if entry:
+            entry['expires_at'] = time.time() + URL_CACHE_MIN_MAX_AGE
+            self._is_dirty = True
+
+    @staticmethod
+    def _max_age(response: httpx.Response) -> int:
+        cache_control = response.headers.get('cache-control', '')
+        if 'no-cache' in cache_control or 'no-store' in cache_control:
+            return URL_CACHE_MIN_MAX_AGE
+
+        match = re.search(r'max-age=(\d+)', cache_control)
+        if match:
+            return max(int(match.group(1)), URL_CACHE_MIN_MAX_AGE)
+
+        return URL_CACHE_DEFAULT_MAX_AGE
+
+    def _evict(self, keep: str = None):
+        total_size = sum(entry.get('size', 0) for entry in self.entries.values())
+        if total_size <= self._max_size:
+            return
+
+        # Remove least recently used files first
+        for digest, entry in sorted(self.entries.items(), key=lambda item: item[1].get('accessed_at', 0)):
+            if total_size <= self._max_size:
+                break
+
+            if digest == keep:
+                continue
+
+            try:
+                os.remove(os.path.join(self._cache_dir, f'{digest}.png'))
+            except FileNotFoundError:
+                pass
+
+            total_size -= entry.get('size', 0)
+            del self.entries[digest]
+            self._is_dirty = True
+
+    def save(self):
+        ''' Called in batches by `storage` '''
+        if not self._is_dirty:
+            return
+
+        os.makedirs(self._cache_dir, exist_ok=True)
+        tmp_path = f'{self._index_path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as fp:
+            json.dump(self.entries, fp)
+        os.replace(tmp_path, self._index_path)
+
+        self._is_dirty = False
+
+
+url_cache = UrlCache()
+storage.on_flush(url_cache.save)
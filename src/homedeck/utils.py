@@ -1,8 +1,7 @@
-import os
 import re
 import shutil
 import subprocess
-import zipfile
+from collections import OrderedDict
 from typing import Union
 
 from materialyoucolor.dynamiccolor.material_dynamic_colors import MaterialDynamicColors
@@ -22,6 +21,38 @@ from .enums import ButtonElementAction
 HAS_OPTIPNG = shutil.which('optipng') is not None
 
 
+class LRUCache(OrderedDict):
+    ''' Dict that drops the least recently used item when it's full '''
+
+    def __init__(self, max_size: int):
+        super().__init__()
+        self.max_size = max_size
+
+    def get(self, key, default=None):
+        if key not in self:
+            return default
+
+        self.move_to_end(key)
+        return self[key]
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+
+        while len(self) > self.max_size:
+            self.popitem(last=False)
+
+
+def freeze(value):
+    ''' Convert nested dicts/lists into hashable tuples '''
+    if isinstance(value, dict):
+        return tuple(sorted(((key, freeze(val)) for key, val in value.items()), key=lambda item: str(item[0])))
+    elif isinstance(value, (list, tuple)):
+        return tuple(freeze(val) for val in value)
+
+    return value
+
+
 def normalize_tuple(offset):
     if isinstance(offset, tuple):
         return offset
@@ -86,6 +117,18 @@ def deep_merge(base: dict, override: dict, *, allow_none=False):
     return base
 
 
+def merged(base: dict, override: dict) -> dict:
+    ''' Same as `deep_merge()`, without modifying `base` '''
+    output = dict(base)
+    for key, value in override.items():
+        if isinstance(output.get(key), dict) and isinstance(value, dict):
+            output[key] = merged(output[key], value)
+        elif key not in output or value is not None:
+            output[key] = value
+
+    return output
+
+
 def apply_presets(*, source: dict, presets_config={}):
     if presets_config is None or not isinstance(source, dict):
         return source
@@ -128,25 +171,6 @@ def apply_presets(*, source: dict, presets_config={}):
     return output
 
 
-def compress_folder(folder_path, output_zip, compress_level=0):
-    method = zipfile.ZIP_STORED if compress_level == 0 else zipfile.ZIP_DEFLATED
-    with zipfile.ZipFile(output_zip, 'w', method, compresslevel=compress_level) as zipf:
-        # Write dummy.txt at the beginning of the zip file
-        dummy_path = os.path.join(folder_path, 'dummy.txt')
-        if (os.path.exists(dummy_path)):
-            zipf.write(dummy_path, os.path.relpath(dummy_path, folder_path))
-
-        for root, _, files in os.walk(folder_path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                if file_path == dummy_path:
-                    # Don't write dummy file again
-                    continue
-
-                arcname = os.path.relpath(file_path, folder_path)  # Preserve folder structure
-                zipf.write(file_path, arcname)
-
-
 def optimize_image(file_path, optimize_level=2):
     if not HAS_OPTIPNG:
         return
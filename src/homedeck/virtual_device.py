@@ -0,0 +1,185 @@
+import asyncio
+import itertools
+import json
+import os
+import shutil
+import time
+from collections import deque
+from typing import Dict, Iterable, List, Tuple, Union
+
+from strmdck.devices.ulanzi_d200 import CommandProtocol, UlanziD200Device
+
+from .build import InMemoryBuildMixin
+
+# Use a virtual deck instead of looking for a real one
+VIRTUAL_DEVICE = int(os.getenv('VIRTUAL_DEVICE', 0)) != 0
+# Save every update of the virtual deck in this directory (<run>-<index>.zip + frames.jsonl), keep them in memory when empty
+VIRTUAL_DEVICE_FRAMES_DIR = os.getenv('VIRTUAL_DEVICE_FRAMES_DIR', '')
+# Button presses to inject once the deck is read: "<seconds>:<button index>[:<duration>]", separated by commas.
+# e.g. "1:0,2.5:3:1" taps button #0 after 1s, holds button #3 for 1s after 2.5s
+VIRTUAL_DEVICE_PRESSES = os.getenv('VIRTUAL_DEVICE_PRESSES', '')
+# Number of frames kept in memory
+VIRTUAL_DEVICE_MAX_FRAMES = 1000
+
+# Duration of a tap
+TAP_DURATION = 0.05
+
+_frame_counter = itertools.count()
+# Frames of several runs are appended to the same frames.jsonl, their zips must not overwrite each other
+_run_id = time.strftime('%Y%m%d-%H%M%S')
+
+
+class _VirtualHidDevice:
+    ''' Replaces the `hid.device()` given to the driver: written packets are counted, read ones are injected '''
+
+    def __init__(self):
+        self._input = deque()
+        self.packets_written = 0
+        self.bytes_written = 0
+
+    def read(self, length: int):
+        return self._input.popleft() if self._input else []
+
+    def write(self, data: bytes):
+        self.packets_written += 1
+        self.bytes_written += len(data)
+        return len(data)
+
+    def inject(self, packet: bytes):
+        self._input.append(packet)
+
+    def close(self):
+        self._input.clear()
+
+
+class VirtualDeckDevice(InMemoryBuildMixin, UlanziD200Device):
+    '''
+    A D200 without hardware, for benchmarks, profiling and tests.
+    The driver still builds every packet, but they are only counted.
+    Updates are captured as frames, in memory (`frames`) and in `frames_dir` when set,
+    and button presses are injected with `press()` or `schedule_presses()`.
+    '''
+
+    DECK_NAME = 'Virtual Ulanzi Stream Controller D200'
+
+    def __init__(self, *, frames_dir: str = VIRTUAL_DEVICE_FRAMES_DIR, presses: Iterable[Tuple[float, int, float]] = ()):
+        super().__init__(_VirtualHidDevice())
+
+        self.frames: deque = deque(maxlen=VIRTUAL_DEVICE_MAX_FRAMES)
+        # What the deck currently shows
+        self.buttons: Dict[int, dict] = {}
+        self.brightness = None
+        self.label_style = None
+
+        self._frames_dir = frames_dir
+        if frames_dir:
+            os.makedirs(frames_dir, exist_ok=True)
+
+        self._presses = list(presses)
+        self._timers: List[asyncio.TimerHandle] = []
+        # Time of the last injected input, to measure how long it takes to update the deck
+        self._input_time = None
+
+    @staticmethod
+    def from_env() -> 'VirtualDeckDevice':
+        return VirtualDeckDevice(presses=VirtualDeckDevice.parse_presses(VIRTUAL_DEVICE_PRESSES))
+
+    @staticmethod
+    def parse_presses(source: str) -> List[Tuple[float, int, float]]:
+        presses = []
+        for item in filter(None, (item.strip() for item in source.split(','))):
+            parts = item.split(':')
+            duration = float(parts[2]) if len(parts) > 2 else TAP_DURATION
+            presses.append((float(parts[0]), int(parts[1]), duration))
+
+        return presses
+
+    @property
+    def hid_device(self) -> _VirtualHidDevice:
+        return self._hid_device
+
+    def set_buttons(self, buttons: Dict[int, Dict], *, update_only=False):
+        super().set_buttons(buttons, update_only=update_only)
+
+        if not update_only:
+            self.buttons = {}
+        for index, button in buttons.items():
+            self.buttons[int(index)] = dict(button) if button else None
+
+        frame = self._add_frame('set_buttons', update_only=update_only, buttons={int(index): button for index, button in buttons.items()})
+        if self._frames_dir:
+            shutil.copyfile(os.path.join('.build', 'build.zip'), os.path.join(self._frames_dir, f'{frame["run"]}-{frame["index"]:06d}.zip'))
+
+    def set_brightness(self, brightness: int, force=False):
+        if not force and brightness == self._brightness:
+            return
+
+        super().set_brightness(brightness, force=force)
+        self.brightness = brightness
+        self._add_frame('set_brightness', brightness=brightness)
+
+    def set_label_style(self, label_style: Dict, force=False):
+        if super().set_label_style(label_style, force=force) is False:
+            return False
+
+        self.label_style = dict(self._label_style)
+        self._add_frame('set_label_style', label_style=self.label_style)
+
+    def _add_frame(self, frame_type: str, **data) -> dict:
+        now = time.time()
+        frame = {
+            'run': _run_id,
+            'index': next(_frame_counter),
+            'time': now,
+            'type': frame_type,
+            # Seconds since the last injected input
+            'since_input': now - self._input_time if self._input_time else None,
+            **data,
+        }
+        self.frames.append(frame)
+
+        if self._frames_dir:
+            with open(os.path.join(self._frames_dir, 'frames.jsonl'), 'a', encoding='utf-8') as fp:
+                fp.write(json.dumps(frame, default=str) + '\n')
+
+        return frame
+
+    def press(self, index: int, *, duration: float = TAP_DURATION, state: int = 1):
+        ''' Presses button `index` now and releases it after `duration` seconds '''
+        self._inject_button(index, pressed=True, state=state)
+        timer = asyncio.get_running_loop().call_later(duration, self._inject_button, index, False, state)
+        self._timers.append(timer)
+
+    def schedule_presses(self, presses: Iterable[Tuple[float, int, float]]):
+        ''' `presses`: (delay in seconds, button index, duration) '''
+        loop = asyncio.get_running_loop()
+        for delay, index, duration in presses:
+            self._timers.append(loop.call_later(delay, lambda index=index, duration=duration: self.press(index, duration=duration)))
+
+    def _inject_button(self, index: int, pressed: bool, state: int = 1):
+        if not self._hid_device:
+            return
+
+        self._input_time = time.time()
+        data = bytes([state, index, 0x01, 0x01 if pressed else 0x00])
+        packet = b'\x7c\x7c' + CommandProtocol.IN_BUTTON.value.to_bytes(2, 'big') + len(data).to_bytes(4, 'little') + data
+        self._hid_device.inject(packet.ljust(1024, b'\x00'))
+
+    async def read_packet(self, length=1024):
+        # Scripted presses start with the reading
+        if self._presses:
+            self.schedule_presses(self._presses)
+            self._presses = []
+
+        async for command in super().read_packet(length):
+            yield command
+
+    def close(self):
+        for timer in self._timers:
+            timer.cancel()
+        self._timers = []
+
+        super().close()
+
+    def get_frames(self, frame_type: Union[str, None] = None) -> List[dict]:
+        return [frame for frame in self.frames if frame_type is None or frame['type'] == frame_type]
@@ -0,0 +1,181 @@
+import asyncio
+
+from homedeck.actions import ActionQueue, ServiceCall
+from homedeck.home_assistant import HomeAssistantError
+
+
+def test_merge_idempotent_calls():
+    call = ServiceCall('light', 'turn_on', {'entity_id': 'light.kitchen'})
+
+    assert call.merge(ServiceCall('light', 'turn_on', {'entity_id': 'light.kitchen'}))
+    assert not call.merge(ServiceCall('light', 'turn_on', {'entity_id': 'light.kitchen', 'brightness': 10}))
+    assert not call.merge(ServiceCall('light', 'turn_off', {'entity_id': 'light.kitchen'}))
+    assert not call.merge(ServiceCall('switch', 'turn_on', {'entity_id': 'light.kitchen'}))
+
+
+def test_toggle_is_not_merged():
+    call = ServiceCall('light', 'toggle', {'entity_id': 'light.kitchen'})
+    assert not call.merge(ServiceCall('light', 'toggle', {'entity_id': 'light.kitchen'}))
+
+
+def test_merge_adds_up_steps():
+    call = ServiceCall('light', 'turn_on', {'entity_id': 'light.kitchen', 'brightness_step_pct': 10})
+
+    assert call.merge(ServiceCall('light', 'turn_on', {'entity_id': 'light.kitchen', 'brightness_step_pct': -5}))
+    assert call.merge(ServiceCall('light', 'turn_on', {'entity_id': 'light.kitchen', 'brightness_step_pct': 20}))
+    assert call.service_data == {'entity_id': 'light.kitchen', 'brightness_step_pct': 25}
+
+    assert not call.merge(ServiceCall('light', 'turn_on', {'entity_id': 'light.kitchen', 'brightness_step': 10}))
+    assert not call.merge(ServiceCall('light', 'turn_on', {'entity_id': 'light.hall', 'brightness_step_pct': 10}))
+    assert call.service_data['brightness_step_pct'] == 25
+
+
+def test_target():
+    assert ServiceCall('light', 'turn_on', {'entity_id': ['light.b', 'light.a']}).target == ('light.a', 'light.b')
+    assert ServiceCall('scene', 'turn_on', {}).target is None
+
+
+class _HomeAssistant:
+    ''' Records service calls, each one waits until it's released '''
+
+    def __init__(self):
+        self.calls = []
+        self.errors = {}
+        self._released = {}
+
+    async def call_service(self, *, domain: str, service: str, service_data: dict):
+        entity_id = service_data.get('entity_id')
+        self.calls.append((f'{domain}.{service}', dict(service_data)))
+
+        event = self._released.setdefault(entity_id, asyncio.Event())
+        await event.wait()
+        event.clear()
+
+        error = self.errors.pop(entity_id, None)
+        if error:
+            raise error
+
+    def release(self, entity_id: str):
+        self._released.setdefault(entity_id, asyncio.Event()).set()
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def _run(test):
+    async def run():
+        ha = _HomeAssistant()
+        failed = []
+        queue = ActionQueue(ha.call_service, on_failed=failed.append)
+        await test(ha, queue, failed)
+
+    asyncio.run(run())
+
+
+def test_lanes_keep_order_per_entity():
+    async def test(ha: _HomeAssistant, queue: ActionQueue, failed: list):
+        queue.submit(domain='light', service='toggle', service_data={'entity_id': 'light.kitchen'})
+        queue.submit(domain='light', service='turn_off', service_data={'entity_id': 'light.kitchen'})
+        queue.submit(domain='switch', service='toggle', service_data={'entity_id': 'switch.fan'})
+        await _settle()
+
+        # The fan doesn't wait for the kitchen's first call
+        assert ha.calls == [('light.toggle', {'entity_id': 'light.kitchen'}), ('switch.toggle', {'entity_id': 'switch.fan'})]
+
+        ha.release('light.kitchen')
+        await _settle()
+        assert ha.calls[-1] == ('light.turn_off', {'entity_id': 'light.kitchen'})
+
+        ha.release('light.kitchen')
+        ha.release('switch.fan')
+        await _settle()
+        assert not queue._lanes
+        assert not failed
+
+    _run(test)
+
+
+def test_repeated_calls_are_merged_while_one_is_in_flight():
+    async def test(ha: _HomeAssistant, queue: ActionQueue, failed: list):
+        for _ in range(3):
+            queue.submit(domain='light', service='turn_on', service_data={'entity_id': 'light.kitchen', 'brightness_step_pct': 10})
+        await _settle()
+
+        ha.release('light.kitchen')
+        await _settle()
+        ha.release('light.kitchen')
+        await _settle()
+
+        assert ha.calls == [
+            ('light.turn_on', {'entity_id': 'light.kitchen', 'brightness_step_pct': 10}),
+            ('light.turn_on', {'entity_id': 'light.kitchen', 'brightness_step_pct': 20}),
+        ]
+        assert not queue._lanes
+
+    _run(test)
+
+
+def test_lane_is_drained_after_an_exception():
+    async def test(ha: _HomeAssistant, queue: ActionQueue, failed: list):
+        queue.submit(domain='light', service='turn_on', service_data={'entity_id': 'light.kitchen'})
+        queue.submit(domain='light', service='turn_off', service_data={'entity_id': 'light.kitchen'})
+        queue.submit(domain='light', service='toggle', service_data={'entity_id': 'light.kitchen'})
+        await _settle()
+
+        ha.errors['light.kitchen'] = HomeAssistantError('Request 3 timed out', code='timeout')
+        ha.release('light.kitchen')
+        await _settle()
+        # Not a HomeAssistantError: printed with its traceback, still drained
+        ha.errors['light.kitchen'] = RuntimeError('Unexpected')
+        ha.release('light.kitchen')
+        await _settle()
+        ha.release('light.kitchen')
+        await _settle()
+
+        assert [name for name, _ in ha.calls] == ['light.turn_on', 'light.turn_off', 'light.toggle']
+        assert [call.name for call in failed] == ['light.turn_on', 'light.turn_off']
+        assert not queue._lanes
+
+    _run(test)
+
+
+def test_cancel_fails_pending_calls():
+    async def test(ha: _HomeAssistant, queue: ActionQueue, failed: list):
+        queue.submit(domain='light', service='toggle', service_data={'entity_id': 'light.kitchen'})
+        queue.submit(domain='light', service='turn_off', service_data={'entity_id': 'light.kitchen'})
+        queue.submit(domain='light', service='toggle', service_data={'entity_id': 'light.kitchen'})
+        await _settle()
+
+        queue.cancel()
+        assert sorted(call.name for call in failed) == ['light.toggle', 'light.turn_off']
+
+        # The call in flight is still sent
+        ha.release('light.kitchen')
+        await _settle()
+        assert [name for name, _ in ha.calls] == ['light.toggle']
+        assert not queue._lanes
+
+    _run(test)
+
+
+def test_failing_on_failed_callback():
+    async def run():
+        ha = _HomeAssistant()
+
+        def on_failed(call: ServiceCall):
+            raise ValueError(call.name)
+
+        queue = ActionQueue(ha.call_service, on_failed=on_failed)
+        queue.submit(domain='light', service='toggle', service_data={'entity_id': 'light.kitchen'})
+        queue.submit(domain='light', service='turn_off', service_data={'entity_id': 'light.kitchen'})
+        await _settle()
+
+        # Printed, the other calls are still cancelled
+        queue.cancel()
+        ha.release('light.kitchen')
+        await _settle()
+        assert not queue._lanes
+
+    asyncio.run(run())
@@ -0,0 +1,62 @@
+import copy
+
+from homedeck.dataclasses import MainConfig
+
+PRESETS = {
+    '$default': {'icon_color': 'FFFFFF'},
+    '$sensor': {'icon': 'mdi:eye'},
+    '$sensor.temperature': {'icon': 'mdi:thermometer'},
+}
+CONFIG = {
+    'presets': PRESETS,
+    'pages': {
+        '$root': {'buttons': [{'entity_id': 'sensor.kitchen'}, {'name': 'Plain'}]},
+        'other': {'buttons': [{'name': 'Other'}]},
+    },
+}
+
+
+class _Device:
+    ICON_WIDTH = 196
+    ICON_HEIGHT = 196
+
+
+def _main_config(all_states: dict) -> MainConfig:
+    main_config = MainConfig(**copy.deepcopy(CONFIG))
+    main_config.post_setup(device=_Device, all_states=all_states)
+    return main_config
+
+
+def test_pages_are_set_up_lazily():
+    main_config = _main_config({})
+    assert not any(page.is_set_up for page in main_config.pages.values())
+
+    main_config.get_page('$root')
+    assert main_config.pages['$root'].is_set_up
+    assert not main_config.pages['other'].is_set_up
+
+
+def test_compare_without_setting_up_pages():
+    main_config = _main_config({})
+    other = _main_config({})
+
+    assert main_config == other
+    assert not any(page.is_set_up for config in (main_config, other) for page in config.pages.values())
+
+    other._pages_source['other'] = {'buttons': [{'name': 'Changed'}]}
+    assert main_config != other
+
+
+def test_set_up_again_when_states_are_received():
+    all_states = {}
+    main_config = _main_config(all_states)
+
+    page = main_config.get_page('$root')
+    assert page.buttons_raw[0]['icon'] == 'mdi:eye'
+    assert main_config.get_page('$root') is page
+
+    all_states['sensor.kitchen'] = {'state': '21', 'attributes': {'device_class': 'temperature'}}
+    new_page = main_config.get_page('$root')
+    assert new_page is not page
+    assert new_page.buttons_raw[0]['icon'] == 'mdi:thermometer'
+    assert main_config.get_page('$root') is new_page
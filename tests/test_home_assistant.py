@@ -0,0 +1,162 @@
+import asyncio
+import socket
+
+from homedeck.fake_home_assistant import FAKE_HA_TOKEN, FakeHomeAssistant
+from homedeck.home_assistant import ALL_ENTITIES, HomeAssistantWebSocket
+
+
+def _client(subscribed_entity_ids=('light.kitchen', 'sensor.kitchen')):
+    ''' A client subscribed to `subscribed_entity_ids`, events are passed to `_on_entities_event` directly '''
+    client = HomeAssistantWebSocket('ws://127.0.0.1:1', 'token')
+    client._subscribed_entity_ids = subscribed_entity_ids
+
+    changes = []
+
+    async def on_state_changed(data):
+        changes.append((data['entity_id'], data['old_state'], data['new_state']))
+
+    client.on_event('state_changed', on_state_changed)
+    return client, changes
+
+
+def _snapshot(client: HomeAssistantWebSocket, event: dict):
+    async def receive():
+        client._entities_snapshot = asyncio.get_running_loop().create_future()
+        await client._on_entities_event(event)
+        assert client._entities_snapshot.done()
+
+    asyncio.run(receive())
+
+
+def _kitchen_snapshot():
+    return {'a': {
+        'light.kitchen': {'s': 'on', 'a': {'friendly_name': 'Kitchen', 'brightness': 100}, 'c': 'A', 'lc': 1.0},
+        'sensor.kitchen': {'s': '21.5', 'a': {'unit_of_measurement': '°C'}, 'c': 'B', 'lc': 1.0},
+    }}
+
+
+def test_added_entities():
+    client, changes = _client()
+    _snapshot(client, _kitchen_snapshot())
+
+    assert dict(client.all_states['light.kitchen']) == {
+        'entity_id': 'light.kitchen',
+        'state': 'on',
+        'attributes': {'friendly_name': 'Kitchen', 'brightness': 100},
+    }
+    assert [(entity_id, old_state) for entity_id, old_state, _ in changes] == [('light.kitchen', None), ('sensor.kitchen', None)]
+
+
+def test_changed_state_and_attributes():
+    client, changes = _client()
+    _snapshot(client, _kitchen_snapshot())
+    changes.clear()
+
+    asyncio.run(client._on_entities_event({'c': {'light.kitchen': {
+        '+': {'s': 'off', 'a': {'color_mode': None}, 'c': 'C', 'lc': 2.0},
+        '-': {'a': ['brightness']},
+    }}}))
+
+    state = client.all_states['light.kitchen']
+    assert state['state'] == 'off'
+    assert state['attributes'] == {'friendly_name': 'Kitchen', 'color_mode': None}
+    assert changes == [('light.kitchen', {'entity_id': 'light.kitchen', 'state': 'on', 'attributes': {'friendly_name': 'Kitchen', 'brightness': 100}}, state)]
+
+
+def test_changed_attributes_only():
+    client, _ = _client()
+    _snapshot(client, _kitchen_snapshot())
+
+    asyncio.run(client._on_entities_event({'c': {'light.kitchen': {'+': {'a': {'brightness': 200}, 'c': 'C', 'lu': 2.0}}}}))
+
+    state = client.all_states['light.kitchen']
+    assert state['state'] == 'on'
+    assert state['attributes'] == {'friendly_name': 'Kitchen', 'brightness': 200}
+
+
+def test_change_of_unknown_entity_is_ignored():
+    client, changes = _client()
+    _snapshot(client, _kitchen_snapshot())
+    changes.clear()
+
+    asyncio.run(client._on_entities_event({'c': {'switch.unknown': {'+': {'s': 'on'}}}}))
+
+    assert 'switch.unknown' not in client.all_states
+    assert changes == []
+
+
+def test_removed_entities():
+    client, changes = _client()
+    _snapshot(client, _kitchen_snapshot())
+    changes.clear()
+
+    asyncio.run(client._on_entities_event({'r': ['sensor.kitchen', 'sensor.unknown']}))
+
+    assert list(client.all_states) == ['light.kitchen']
+    assert [(entity_id, new_state) for entity_id, _, new_state in changes] == [('sensor.kitchen', None)]
+
+
+def test_snapshot_removes_missing_entities():
+    client, changes = _client()
+    _snapshot(client, _kitchen_snapshot())
+    changes.clear()
+
+    # Reconnected: sensor.kitchen was removed while disconnected, light.kitchen didn't change
+    snapshot = _kitchen_snapshot()
+    del snapshot['a']['sensor.kitchen']
+    _snapshot(client, snapshot)
+
+    assert list(client.all_states) == ['light.kitchen']
+    assert [(entity_id, new_state) for entity_id, _, new_state in changes] == [('sensor.kitchen', None)]
+
+
+def test_snapshot_of_all_entities_removes_missing_entities():
+    client, changes = _client(ALL_ENTITIES)
+    _snapshot(client, _kitchen_snapshot())
+    changes.clear()
+
+    snapshot = _kitchen_snapshot()
+    del snapshot['a']['light.kitchen']
+    _snapshot(client, snapshot)
+
+    assert list(client.all_states) == ['sensor.kitchen']
+    assert [(entity_id, new_state) for entity_id, _, new_state in changes] == [('light.kitchen', None)]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_subscribe_to_all_entities():
+    ''' Used when an entity ID of the configuration is not a literal (referenced_entities is None) '''
+    async def run():
+        fake_ha = FakeHomeAssistant(seed=1)
+        fake_ha.set_state('light.kitchen', 'on', {'friendly_name': 'Kitchen'})
+        fake_ha.set_state('switch.fan', 'off', {'friendly_name': 'Fan'})
+
+        port = _free_port()
+        server = asyncio.get_running_loop().create_task(fake_ha.serve(port=port))
+        await asyncio.sleep(0.1)
+
+        client = HomeAssistantWebSocket(f'ws://127.0.0.1:{port}', FAKE_HA_TOKEN)
+        try:
+            async with client.connect():
+                await client.subscribe_entities(None)
+                assert client._entity_ids is ALL_ENTITIES
+                assert sorted(client.all_states) == ['light.kitchen', 'switch.fan']
+
+                # Entities created later are received too
+                fake_ha.set_state('sensor.new', '12')
+                fake_ha.remove_entity('switch.fan')
+                for _ in range(50):
+                    if 'sensor.new' in client.all_states and 'switch.fan' not in client.all_states:
+                        break
+                    await asyncio.sleep(0.01)
+
+                assert sorted(client.all_states) == ['light.kitchen', 'sensor.new']
+        finally:
+            server.cancel()
+
+    asyncio.run(run())
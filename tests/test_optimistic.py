@@ -0,0 +1,163 @@
+import asyncio
+
+from homedeck.home_assistant import HomeAssistantWebSocket
+from homedeck.optimistic import OptimisticStates
+
+ENTITY_ID = 'light.kitchen'
+
+
+class _Deck:
+    ''' Home Assistant client with a light and a sensor, and the optimistic states of a deck '''
+
+    def __init__(self, *, timeout: float = 5):
+        self.ha = HomeAssistantWebSocket('ws://127.0.0.1:1', 'token')
+        self.ha._subscribed_entity_ids = (ENTITY_ID, 'sensor.kitchen')
+        self.changed = 0
+        self.optimistic = OptimisticStates(self.ha, self._on_changed, timeout=timeout)
+
+    def _on_changed(self):
+        self.changed += 1
+
+    async def receive_snapshot(self):
+        self.ha._entities_snapshot = asyncio.get_running_loop().create_future()
+        await self.ha._on_entities_event({'a': {
+            ENTITY_ID: {'s': 'off', 'a': {'friendly_name': 'Kitchen'}, 'c': 'A', 'lc': 1.0},
+            'sensor.kitchen': {'s': '21.5', 'a': {}, 'c': 'B', 'lc': 1.0},
+        }})
+
+    async def report(self, state: str = None, attributes: dict = None):
+        diff = {'c': 'C'}
+        if state:
+            diff['s'] = state
+        if attributes:
+            diff['a'] = attributes
+        await self.ha._on_entities_event({'c': {ENTITY_ID: {'+': diff}}})
+
+    def toggle(self) -> bool:
+        return self.optimistic.predict(domain='light', service='toggle', service_data={'entity_id': ENTITY_ID})
+
+    @property
+    def state(self) -> str:
+        return self.ha.all_states[ENTITY_ID]['state']
+
+
+def _run(test):
+    async def run():
+        deck = _Deck()
+        await deck.receive_snapshot()
+        await test(deck)
+
+    asyncio.run(run())
+
+
+def test_predict():
+    async def test(deck: _Deck):
+        assert deck.toggle()
+        assert deck.state == 'on'
+        assert deck.changed == 1
+
+        # Already predicted "on"
+        assert not deck.optimistic.predict(domain='light', service='turn_on', service_data={'entity_id': ENTITY_ID})
+        # Not an on/off entity
+        assert not deck.optimistic.predict(domain='homeassistant', service='toggle', service_data={'entity_id': 'sensor.kitchen'})
+        assert not deck.optimistic.predict(domain='light', service='toggle', service_data={'entity_id': 'light.unknown'})
+        assert deck.changed == 1
+
+    _run(test)
+
+
+def test_confirm():
+    async def test(deck: _Deck):
+        deck.toggle()
+
+        # Only attributes changed: still predicted
+        await deck.report(attributes={'brightness': 10})
+        assert deck.state == 'on'
+
+        await deck.report('on')
+        assert deck.state == 'on'
+        assert deck.ha.all_states[ENTITY_ID]['attributes'] == {'friendly_name': 'Kitchen', 'brightness': 10}
+        assert not deck.ha.discard_prediction(ENTITY_ID)
+
+    _run(test)
+
+
+def test_changed_by_something_else():
+    async def test(deck: _Deck):
+        deck.toggle()
+
+        await deck.report('unavailable')
+        assert deck.state == 'unavailable'
+        assert not deck.ha.discard_prediction(ENTITY_ID)
+
+    _run(test)
+
+
+def test_reconcile_quick_toggles():
+    ''' The results of earlier calls don't replace the newest prediction '''
+    async def test(deck: _Deck):
+        for _ in range(3):
+            deck.toggle()
+        assert deck.state == 'on'
+
+        shown = []
+        for state in ('on', 'off', 'on'):
+            await deck.report(state)
+            shown.append(deck.state)
+
+        assert shown == ['on', 'on', 'on']
+        assert not deck.ha.discard_prediction(ENTITY_ID)
+
+    _run(test)
+
+
+def test_reconcile_toggled_back():
+    async def test(deck: _Deck):
+        deck.toggle()
+        deck.toggle()
+        assert deck.state == 'off'
+
+        await deck.report('on')
+        assert deck.state == 'off'
+        await deck.report('off')
+        assert deck.state == 'off'
+        assert not deck.ha.discard_prediction(ENTITY_ID)
+
+    _run(test)
+
+
+def test_rollback():
+    async def test(deck: _Deck):
+        deck.toggle()
+        deck.toggle()
+        deck.toggle()
+
+        deck.optimistic.rollback({'entity_id': ENTITY_ID})
+        assert deck.state == 'off'
+        assert deck.changed == 4
+
+        # Reported later: shown as is
+        await deck.report('on')
+        assert deck.state == 'on'
+
+    _run(test)
+
+
+def test_timeout():
+    async def run():
+        deck = _Deck(timeout=0.01)
+        await deck.receive_snapshot()
+
+        deck.toggle()
+        await asyncio.sleep(0.05)
+        assert deck.state == 'off'
+        assert deck.changed == 2
+
+        # Confirmed in time: nothing to roll back
+        deck.toggle()
+        await deck.report('on')
+        await asyncio.sleep(0.05)
+        assert deck.state == 'on'
+        assert deck.changed == 3
+
+    asyncio.run(run())
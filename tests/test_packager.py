@@ -0,0 +1,117 @@
+import io
+import random
+import zipfile
+import zlib
+
+from homedeck import build
+from homedeck.build import BuildDirectory
+from homedeck.packager import ZipEntry, build_upload, build_zip, is_valid_zip
+
+
+def _read_zip(data: bytes) -> zipfile.ZipFile:
+    zip_file = zipfile.ZipFile(io.BytesIO(data))
+    assert zip_file.testzip() is None
+    return zip_file
+
+
+def test_build_zip_round_trip():
+    files = {
+        'manifest.json': b'{"0_0": {"State": 0}}',
+        'icons/1234.png': bytes(range(256)) * 64,
+        'icons/empty.png': b'',
+    }
+
+    zip_file = _read_zip(build_zip(ZipEntry(name, data) for name, data in files.items()))
+
+    assert zip_file.namelist() == list(files)
+    for info in zip_file.infolist():
+        assert info.compress_type == zipfile.ZIP_DEFLATED
+        assert info.CRC == zlib.crc32(files[info.filename])
+        assert info.file_size == len(files[info.filename])
+        assert zip_file.read(info) == files[info.filename]
+
+
+def test_entries_are_reusable():
+    entry = ZipEntry('icons/a.png', b'a' * 1000)
+
+    first = _read_zip(build_zip([entry]))
+    second = _read_zip(build_zip([ZipEntry('manifest.json', b'{}'), entry]))
+
+    assert first.read('icons/a.png') == second.read('icons/a.png') == b'a' * 1000
+
+
+def test_is_valid_zip():
+    data = bytearray(b'\x01' * 3000)
+    assert is_valid_zip(bytes(data))
+
+    for invalid_byte in (0x00, 0x7c):
+        data[1016 + 1024] = invalid_byte
+        assert not is_valid_zip(bytes(data))
+
+    # Only every 1016 + 1024k byte matters
+    data[1016 + 1024] = 0x01
+    data[1015] = 0x00
+    assert is_valid_zip(bytes(data))
+
+
+def _invalid_entries():
+    ''' Icons that give an invalid zip on their own '''
+    for seed in range(1000):
+        data = random.Random(seed).randbytes(4096)
+        entries = [ZipEntry('manifest.json', b'{}'), ZipEntry('icons/icon.png', data)]
+        if not is_valid_zip(build_zip(entries)):
+            return entries, data
+
+    raise AssertionError('No invalid zip found')
+
+
+def test_build_upload_adds_dummy_padding():
+    entries, data = _invalid_entries()
+
+    upload = build_upload(entries)
+    assert is_valid_zip(upload)
+
+    zip_file = _read_zip(upload)
+    assert zip_file.namelist() == ['dummy.txt', 'manifest.json', 'icons/icon.png']
+    assert zip_file.read('icons/icon.png') == data
+
+
+def test_build_upload_without_padding():
+    entries = [ZipEntry('manifest.json', b'{}')]
+    assert build_upload(entries) == build_zip(entries)
+
+
+def test_write_zip(tmp_path, monkeypatch):
+    monkeypatch.setattr(build, 'BUILD_DIR', str(tmp_path))
+    monkeypatch.setattr(build, 'BUILD_ZIP_PATH', str(tmp_path / 'build.zip'))
+    entries, _ = _invalid_entries()
+
+    BuildDirectory()._write_zip(entries)
+
+    written = (tmp_path / 'build.zip').read_bytes()
+    assert is_valid_zip(written)
+    assert not (tmp_path / 'build.zip.tmp').exists()
+
+
+def test_prepare_reuses_entries(tmp_path, monkeypatch):
+    monkeypatch.setattr(build, 'BUILD_DIR', str(tmp_path))
+    monkeypatch.setattr(build, 'BUILD_ZIP_PATH', str(tmp_path / 'build.zip'))
+    monkeypatch.setattr(build, 'GENERATED_ICONS_DIR', str(tmp_path))
+    for name in ('a.png', 'b.png'):
+        (tmp_path / name).write_bytes(name.encode('utf-8') * 100)
+
+    build_directory = BuildDirectory()
+    assert build_directory.prepare({0: {'name': 'A', 'icon': 'a.png'}, 6: {'icon': 'b.png'}, 7: None}, columns=5)
+    assert build_directory.live_icons == {'a.png', 'b.png'}
+
+    zip_file = _read_zip((tmp_path / 'build.zip').read_bytes())
+    assert sorted(zip_file.namelist()) == ['icons/a.png', 'icons/b.png', 'manifest.json']
+    assert zip_file.read('icons/a.png') == b'a.png' * 100
+    manifest = zip_file.read('manifest.json').decode('utf-8')
+    assert '"0_0"' in manifest and '"1_1"' in manifest and '"2_1"' in manifest
+
+    # Compressed once, even when the file is gone
+    (tmp_path / 'a.png').unlink()
+    build_directory.prepare({0: {'icon': 'a.png'}, 6: None}, columns=5)
+    assert build_directory.live_icons == {'a.png'}
+    assert _read_zip((tmp_path / 'build.zip').read_bytes()).read('icons/a.png') == b'a.png' * 100
@@ -0,0 +1,119 @@
+from collections import ChainMap
+from collections.abc import Mapping
+
+from homedeck.states import EntityState, StateStore
+
+
+def _store(attribute_names=None) -> StateStore:
+    store = StateStore()
+    store.keep_attributes(attribute_names)
+    return store
+
+
+def test_entity_state_is_a_mapping():
+    state = EntityState('light.kitchen', 'on', {'brightness': 100})
+
+    assert isinstance(state, Mapping)
+    assert state['state'] == 'on'
+    assert state.get('attributes', {}) == {'brightness': 100}
+    assert state.get('last_changed') is None
+    assert list(state) == ['entity_id', 'state', 'attributes']
+    assert len(state) == 3
+    assert dict(state) == {'entity_id': 'light.kitchen', 'state': 'on', 'attributes': {'brightness': 100}}
+
+    # Equal to Home Assistant's dicts with the same keys
+    assert state == {'entity_id': 'light.kitchen', 'state': 'on', 'attributes': {'brightness': 100}}
+    assert state == EntityState('light.kitchen', 'on', {'brightness': 100})
+    assert state != state.with_state('off')
+
+
+def test_states_and_names_are_interned():
+    store = _store()
+    # Built at runtime, like strings decoded from a message
+    first = store.make_state(''.join(['light.', 'kitchen']), ''.join(['o', 'n']), {''.join(['bright', 'ness']): 1})
+    second = store.make_state(''.join(['light.', 'kitchen']), ''.join(['o', 'n']), {''.join(['bright', 'ness']): 2})
+
+    assert first.entity_id is second.entity_id
+    assert first.state is second.state
+    assert next(iter(first.attributes)) is next(iter(second.attributes))
+
+
+def test_numbers_and_long_states_are_not_interned():
+    store = _store()
+    for value in ('21.5', '-3', 'x' * 40):
+        first = store.make_state('sensor.a', ''.join(value), {})
+        second = store.make_state('sensor.a', ''.join([value[:1], value[1:]]), {})
+        assert first.state == second.state
+        assert first.state is not second.state
+
+
+def test_store_is_a_read_only_mapping():
+    store = _store()
+    store.set_state(store.make_state('light.kitchen', 'on', {}))
+
+    assert isinstance(store, Mapping)
+    assert not hasattr(store, '__setitem__')
+    assert 'light.kitchen' in store
+    assert store['light.kitchen']['state'] == 'on'
+    assert store.get('light.unknown') is None
+    assert list(store) == ['light.kitchen']
+    assert len(store) == 1
+
+
+def test_unused_attributes_are_dropped():
+    store = _store({'brightness'})
+    state = store.make_state('light.kitchen', 'on', {'brightness': 100, 'friendly_name': 'Kitchen', 'color_temp': 300})
+
+    # Built-in attributes are always kept
+    assert state.attributes == {'brightness': 100, 'friendly_name': 'Kitchen'}
+
+
+def test_narrower_attributes_are_dropped_now():
+    store = _store()
+    store.set_state(store.make_state('light.kitchen', 'on', {'brightness': 100, 'color_temp': 300}))
+
+    assert not store.keep_attributes({'brightness'})
+    assert store['light.kitchen'].attributes == {'brightness': 100}
+
+
+def test_wider_attributes_must_be_received_again():
+    store = _store({'brightness'})
+
+    assert store.keep_attributes({'brightness', 'color_temp'})
+    assert store.keep_attributes(None)
+    assert not store.keep_attributes(None)
+
+
+def test_apply_diff_shares_unchanged_attributes():
+    store = _store()
+    old_state = store.make_state('light.kitchen', 'on', {'brightness': 100})
+
+    new_state = store.apply_diff(old_state, state='off')
+    assert new_state['state'] == 'off'
+    assert new_state.attributes is old_state.attributes
+
+    new_state = store.apply_diff(old_state, attributes={'color_mode': None}, removed_attributes=['brightness'])
+    assert new_state['state'] == 'on'
+    assert new_state.attributes == {'color_mode': None}
+    # The old state is not modified
+    assert old_state.attributes == {'brightness': 100}
+
+
+def test_updates_are_seen_by_readers_of_the_store():
+    ''' The store is shared with the configuration and pages, it's updated in place '''
+    store = _store()
+    store.set_state(store.make_state('light.kitchen', 'on', {}))
+    store.set_state(store.make_state('light.hall', 'on', {}))
+    # Like the predicted states of PageElement.state_variants
+    reader = ChainMap({}, store)
+    old_state = reader['light.kitchen']
+
+    store.set_state(store.apply_diff(old_state, state='off'))
+    store.retain(['light.kitchen'])
+
+    assert reader['light.kitchen']['state'] == 'off'
+    assert 'light.hall' not in reader
+    # States are replaced, not modified
+    assert old_state['state'] == 'on'
+    assert store.pop('light.kitchen')['state'] == 'off'
+    assert len(reader) == 0
@@ -0,0 +1,36 @@
+import os
+
+from homedeck.storage import Storage
+
+
+def _write(path, name: str, mtime: int):
+    file_path = os.path.join(path, name)
+    with open(file_path, 'wb') as fp:
+        fp.write(b'x' * 100)
+    os.utime(file_path, (mtime, mtime))
+
+
+def test_trim_evicts_least_recently_used(tmp_path):
+    for index in range(10):
+        _write(tmp_path, f'{index}.png', 1000 + index)
+
+    # Reused: touched on cache hit
+    os.utime(tmp_path / '0.png')
+
+    assert Storage._trim(str(tmp_path), 800)
+    assert sorted(os.listdir(tmp_path)) == ['0.png', '5.png', '6.png', '7.png', '8.png', '9.png']
+
+
+def test_trim_keeps_files_in_use(tmp_path):
+    for index in range(10):
+        _write(tmp_path, f'{index}.png', 1000 + index)
+
+    assert Storage._trim(str(tmp_path), 800, {'0.png', '1.png'})
+    assert sorted(os.listdir(tmp_path)) == ['0.png', '1.png', '6.png', '7.png', '8.png', '9.png']
+
+
+def test_trim_under_max_size(tmp_path):
+    _write(tmp_path, 'a.png', 1000)
+
+    assert not Storage._trim(str(tmp_path), 800)
+    assert os.listdir(tmp_path) == ['a.png']
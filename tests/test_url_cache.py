@@ -0,0 +1,156 @@
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+
+from homedeck.url_cache import URL_CACHE_DEFAULT_MAX_AGE, URL_CACHE_MIN_MAX_AGE, UrlCache
+
+URL = 'https://example.com/kitchen.png'
+
+
+class _Server:
+    ''' Serves `content` with an ETag, answers 304 to matching conditional requests '''
+
+    def __init__(self, content: bytes = b'image', etag: str = '"1"', cache_control: str = 'max-age=3600'):
+        self.content = content
+        self.etag = etag
+        self.cache_control = cache_control
+        self.requests = []
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        headers = {'etag': self.etag}
+        if self.cache_control:
+            headers['cache-control'] = self.cache_control
+
+        if request.headers.get('if-none-match') == self.etag:
+            return httpx.Response(304, headers=headers)
+
+        return httpx.Response(200, content=self.content, headers=headers)
+
+    def fetch(self, url_cache: UrlCache) -> bool:
+        return _fetch(url_cache, self.handle)
+
+
+def _fetch(url_cache: UrlCache, handler) -> bool:
+    async def fetch():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await url_cache.fetch(client, URL)
+
+    return asyncio.run(fetch())
+
+
+def test_download(tmp_path):
+    url_cache = UrlCache(str(tmp_path))
+    server = _Server()
+
+    assert url_cache.is_stale(URL)
+    assert server.fetch(url_cache)
+
+    with open(url_cache.file_path(URL), 'rb') as fp:
+        assert fp.read() == b'image'
+    assert url_cache.version(URL)
+    assert not url_cache.is_stale(URL)
+    assert 'if-none-match' not in server.requests[0].headers
+
+
+def test_revalidate_with_etag(tmp_path):
+    url_cache = UrlCache(str(tmp_path))
+    server = _Server()
+    server.fetch(url_cache)
+    version = url_cache.version(URL)
+    url_cache.entries[UrlCache.digest(URL)]['expires_at'] = 0
+
+    # Not modified
+    assert not server.fetch(url_cache)
+    assert server.requests[-1].headers['if-none-match'] == '"1"'
+    assert url_cache.version(URL) == version
+    assert not url_cache.is_stale(URL)
+
+    # Modified
+    server.content = b'new image'
+    server.etag = '"2"'
+    assert server.fetch(url_cache)
+    assert url_cache.version(URL) != version
+    with open(url_cache.file_path(URL), 'rb') as fp:
+        assert fp.read() == b'new image'
+
+
+def test_same_content_is_not_a_change(tmp_path):
+    url_cache = UrlCache(str(tmp_path))
+    server = _Server()
+    server.fetch(url_cache)
+
+    # New ETag, same content
+    server.etag = '"2"'
+    assert not server.fetch(url_cache)
+
+
+@pytest.mark.parametrize('cache_control, max_age', [
+    ('max-age=3600', 3600),
+    ('public, max-age=120', 120),
+    ('max-age=0', URL_CACHE_MIN_MAX_AGE),
+    ('max-age=10', URL_CACHE_MIN_MAX_AGE),
+    ('no-cache', URL_CACHE_MIN_MAX_AGE),
+    ('no-store', URL_CACHE_MIN_MAX_AGE),
+    (None, URL_CACHE_DEFAULT_MAX_AGE),
+])
+def test_max_age(tmp_path, cache_control, max_age):
+    url_cache = UrlCache(str(tmp_path))
+    now = time.time()
+    _Server(cache_control=cache_control).fetch(url_cache)
+
+    assert now + max_age <= url_cache.expires_at(URL) <= time.time() + max_age
+
+
+def test_failed_request_postpones_revalidation(tmp_path):
+    url_cache = UrlCache(str(tmp_path))
+    _Server().fetch(url_cache)
+    url_cache.entries[UrlCache.digest(URL)]['expires_at'] = 0
+
+    def handle(request):
+        raise httpx.ConnectError('Unreachable', request=request)
+
+    with pytest.raises(httpx.ConnectError):
+        _fetch(url_cache, handle)
+
+    assert not url_cache.is_stale(URL)
+    assert url_cache.expires_at(URL) <= time.time() + URL_CACHE_MIN_MAX_AGE
+
+
+def test_index_is_persisted(tmp_path):
+    url_cache = UrlCache(str(tmp_path))
+    _Server().fetch(url_cache)
+    url_cache.save()
+
+    reloaded = UrlCache(str(tmp_path))
+    assert reloaded.version(URL) == url_cache.version(URL)
+    assert reloaded.expires_at(URL) == url_cache.expires_at(URL)
+
+    # Revalidated with the saved ETag
+    server = _Server()
+    reloaded.entries[UrlCache.digest(URL)]['expires_at'] = 0
+    assert not server.fetch(reloaded)
+    assert server.requests[0].headers['if-none-match'] == '"1"'
+
+
+def test_save_only_when_changed(tmp_path):
+    url_cache = UrlCache(str(tmp_path))
+    url_cache.save()
+    assert not (tmp_path / 'index.json').exists()
+
+
+def test_corrupt_index(tmp_path):
+    (tmp_path / 'index.json').write_text('{"abc": {"url": ', encoding='utf-8')
+
+    url_cache = UrlCache(str(tmp_path))
+    assert url_cache.entries == {}
+    assert url_cache.is_stale(URL)
+
+    assert _Server().fetch(url_cache)
+    url_cache.save()
+
+    with open(tmp_path / 'index.json', 'r', encoding='utf-8') as fp:
+        assert list(json.load(fp)) == [UrlCache.digest(URL)]